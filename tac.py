@@ -2,11 +2,127 @@
 
 import sys
 import datetime
+import multiprocessing.pool
+import threading
+import Queue
 
 import tac_project
 import tac_common
 
 
+def prepare(project):
+    """Convert the project if needed in a thread of the conversion pool and return (True if it has been
+    converted, error message or None)."""
+    try:
+        return project.prepare(), None
+    except Exception as e:
+        return False, 'Failed to prepare "%s": %s' % (project.project_dir, str(e))
+
+
+def wait(result):
+    """Return the value of the AsyncResult of the conversion pool once it is ready."""
+    while not result.ready():
+        # waiting with a timeout can be interrupted by Ctrl-C
+        result.wait(tac_project.WAIT_INTERVAL)
+    return result.get()
+
+
+def run_project(project, log):
+    """Load, run and check the project and return 'passed', 'failed', 'aborted' or None if it is skipped."""
+    if not (project.load()):
+        log.warning('Skipping project')
+        return None
+    if project.run():
+        if project.check():
+            log.info('"%s" passed' % project.project_dir)
+            return 'passed'
+        else:
+            log.info('"%s" failed' % project.project_dir)
+            return 'failed'
+    else:
+        log.info('"%s" aborted' % project.project_dir)
+        return 'aborted'
+
+
+def run_concurrently(projects, scheduler, conversions, log):
+    """Run projects in the order of the scheduler, those on disjoint physical ports at the same time, and
+    return their results in the order of projects. A project being prepared (conversions: project index ->
+    AsyncResult of prepare()) is made available to the scheduler once it is converted or found up to date. The
+    log of each project is kept and logged when it finishes."""
+    results = [None] * len(projects)
+    finished = Queue.Queue()  # (project index, True, result of prepare()) or (index, result, records)
+
+    def prepared(i):
+        finished.put((i, True, wait(conversions[i])))
+
+    def worker(i):
+        project_log = tac_common.RecordingLog()
+        projects[i].log = project_log
+        try:
+            result = run_project(projects[i], project_log)
+        except BaseException as e:
+            # sys.exit() of a project only ends its thread
+            project_log.error('Unexpected error while running "%s": %s' % (projects[i].project_dir, str(e)))
+            result = 'aborted'
+        finished.put((i, result, project_log.records))
+
+    for i in conversions:
+        thread = threading.Thread(target=prepared, args=(i,))
+        thread.daemon = True
+        thread.start()
+    running = dict()  # project index -> thread
+    while scheduler.pending or running:
+        for i in scheduler.start():
+            running[i] = threading.Thread(target=worker, args=(i,))
+            running[i].daemon = True
+            running[i].start()
+            log.info('Started "%s"' % projects[i].project_dir)
+        while True:
+            try:
+                # waiting with a timeout can be interrupted by Ctrl-C
+                i, result, records = finished.get(True, tac_project.WAIT_INTERVAL)
+                break
+            except Queue.Empty:
+                continue
+        if result is True:
+            converted, error = records
+            if not error:
+                try:
+                    scheduler.make_available(i, tac_project.physical_ports([projects[i]])[0], projects[i].duration())
+                except Exception as e:
+                    error = 'Cannot read AutomationConfig of "%s": %s' % (projects[i].project_dir, str(e))
+            if error:
+                # the conversion has failed or its result can't be read
+                log.separator()
+                log.error(error)
+                log.info('"%s" aborted' % projects[i].project_dir)
+                results[i] = 'aborted'
+                scheduler.skip(i)
+            elif converted:
+                log.info('Converted "%s"' % projects[i].project_dir)
+            continue
+        results[i] = result
+        running.pop(i).join()
+        scheduler.finish(i)
+        log.separator()
+        for level, message in records:
+            getattr(log, level)(message)
+    return results
+
+
+def log_plan(projects, scheduler, log):
+    """Log the predicted start and finish time of each project and the predicted finish of the batch."""
+    now = datetime.datetime.now()
+    times = scheduler.plan()
+    log.info('Schedule (%s, %d at a time):' % ('longest first' if scheduler.lpt else 'in order', scheduler.concurrent))
+    for i in sorted(xrange(len(projects)), key=lambda i: times[i]):
+        start, finish = (now + datetime.timedelta(seconds=t / 1000) for t in times[i])
+        log.info('\t%s - %s  %s' % (start.strftime("%H:%M:%S"), finish.strftime("%H:%M:%S"), projects[i].project_dir))
+    makespan = max(finish for start, finish in times) if times else 0
+    log.info('Predicted makespan:       %s' % datetime.timedelta(seconds=makespan / 1000))
+    log.info('Predicted finish time:    %s' % (now + datetime.timedelta(seconds=makespan / 1000)).strftime("%H:%M:%S %d.%m.%y"))
+
+
 #
 # Main
 #
@@ -14,6 +130,7 @@ def main():
     params = tac_common.Arguments()
     log = tac_common.Logger(params.log_file, params.verbose)
     projects = []
+    durations = []
     passed = 0
     failed = 0
     aborted = 0
@@ -32,26 +149,58 @@ def main():
         project = tac_project.LdxProject(dir, params, log)
         if project:
             projects.append(project)
-            total_duration += project.duration()
+    # durations and ports are estimated from AutomationConfig as it is, before any project is converted again;
+    # those of projects never converted are not known yet
+    unknown = 0
+    for project in projects:
+        if project.converted():
+            durations.append(project.duration())
+            total_duration += durations[-1]
+        else:
+            durations.append(0)
+            unknown += 1
+    if params.concurrent > 1 or params.dry_run:
+        ports = tac_project.physical_ports(projects)
+    conversions = dict()
+    if not params.dry_run:
+        # projects are checked for changes and converted in the background, each one runs as soon as it is
+        # prepared; a dry run converts nothing
+        pool = multiprocessing.pool.ThreadPool(params.converters)
+        conversions = dict((i, pool.apply_async(prepare, (project,))) for i, project in enumerate(projects))
+        pool.close()
     total_duration = datetime.timedelta(seconds=total_duration / 1000)
     finish_time = datetime.datetime.now() + total_duration
     log.info('Number of tests to run:   %s' % len(params.folders))
-    log.info('Estimated total duration: %s' % total_duration)
+    log.info('Estimated total duration: %s' % total_duration +
+             (' (%d projects not converted yet)' % unknown if unknown else ''))
     log.info('Estimated finish time:    %s' % finish_time.strftime("%H:%M:%S %d.%m.%y"))
-    for project in projects:
+    if params.concurrent > 1 or params.dry_run:
+        # ports and durations of projects being prepared are read again once they are prepared
+        available = [i for i in xrange(len(projects)) if i not in conversions]
+        scheduler = tac_project.Scheduler(ports, durations, params.concurrent, params.schedule == 'lpt', available)
+        if params.dry_run:
+            log_plan(projects, scheduler, log)
+            sys.exit(0)
+    if params.concurrent > 1:
         log.separator()
-        if not (project.load()):
-            log.warning('Skipping project')
-            continue
-        if project.run():
-            if project.check():
-                log.info('"%s" passed' % project.project_dir)
-                passed += 1
-            else:
-                log.info('"%s" failed' % project.project_dir)
-                failed += 1
-        else:
-            log.info('"%s" aborted' % project.project_dir)
+        results = run_concurrently(projects, scheduler, conversions, log)
+    else:
+        results = []
+        for i, project in enumerate(projects):
+            log.separator()
+            converted, error = wait(conversions[i])
+            if error:
+                log.error(error)
+                log.info('"%s" aborted' % project.project_dir)
+                results.append('aborted')
+                continue
+            results.append(run_project(project, log))
+    for result in results:
+        if result == 'passed':
+            passed += 1
+        elif result == 'failed':
+            failed += 1
+        elif result == 'aborted':
             aborted += 1
 
     log.info('\tTotal attempted: ' + str(passed + failed + aborted))
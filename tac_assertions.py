@@ -1,32 +1,74 @@
+import copy
 import datetime
+import functools
+import hashlib
+import multiprocessing
 import os
 import re
 import collections
+import tempfile
 
 import swifttest
 
 import tac_common
 import tac_calculation
+import tac_summary
+import tac_vectorized
 
 #
 # Regexps
 #
 SUMMARY_FILE_RX = '([Cc]lient|[Ss]erver)\s+[Pp]ort\s+([0-9]+)\s*\(([0-9.]+) [Pp]ort ([0-9]+)\).sum(mary)?'
 ASSERTION_FILE_RX = '.*\.assertions$'
-RULE_RX = 'ANY|ANY_EXCEPT_LAST|LAST|SPAN\[\d+:\d+\]'
-COUNTER_RX = "(((([cs])port)(\d+)?).)?([a-zA-Z0-9._]+)$"
+RULE_RX = re.compile(r'\s*(ANY_EXCEPT_LAST|ANY|LAST|SPAN\[(\d+):(\d+)\])(?![\w.])')
+# tokens following the rule prefix, tried in this order at each position of the expression
+TOKEN_RX = re.compile(r'''\s*(?:
+      (?P<num>\d+(?:\.\d*)?)(?![\w.])
+    | (?P<var>(?:(?P<port>(?P<kind>[cs])port(?P<number>\d+)?)\.)?(?P<stat>[a-zA-Z0-9._]+))(?:\s*@\s*(?P<modifier>\w+))?
+    | (?P<op><=|>=|==|!=|[!*/%+\-<>&|()])
+    )''', re.X)
+MODIFIER_RX = '(\d+)([smh])$'
 
 #
 # Constants
 #
 DEFAULT_ASSERTIONS_FILE = os.path.join(os.path.expanduser('~'), '.tac', 'default.assertions')
 INTEGRITY_ASSERTIONS_FILE = os.path.join(os.path.expanduser('~'), '.tac', 'integrity.assertions')
+RULESET_CACHE_VERSION = 8  # increase whenever the compiled form of Assertion changes
 CONSTANTS = {'const_name': 0}
-OPERATORS = {'!', '*', '/', '%', '+', '-', '<', '<=', '>', '>=', '==', '!=', '&', '|', '(', ')', '@'}
 MODIFIERS = {'sec':2, 'min':120}
+MODIFIER_UNITS = {'s': 2, 'm': 120, 'h': 7200}  # ticks per unit of @Ns, @Nm and @Nh modifiers
+SUMMARY_CACHE_FILE = '.tac-summaries'  # columns and header of the summary cache of a results directory
+SUMMARY_CACHE_VERSION = 2  # increase whenever the format of the summary cache changes
+VERDICT_CACHE_FILE = '.tac-verdicts.cache'  # verdicts of assertions checked against a results directory
+VERDICT_CACHE_VERSION = 4  # increase whenever verdicts of unchanged assertions may change
 Token = collections.namedtuple('Token', ['name', 'value', 'modifier'])
 
 
+def modifier_ticks(modifier):
+    """Return the rate window of the modifier in ticks, or None if the modifier is not valid."""
+    if modifier in MODIFIERS:
+        return MODIFIERS[modifier]
+    match = re.match(MODIFIER_RX, modifier)
+    if match and int(match.group(1)) > 0:
+        return int(match.group(1)) * MODIFIER_UNITS[match.group(2)]
+    return None
+
+
+class Diagnostic(collections.namedtuple('Diagnostic', ['tick', 'lport', 'values', 'subexpressions'])):
+    """Description of an assertion failure: the tick, the logical port (None for expressions over several
+    ports), (variable name, physical port, value) triples and (sub-expression, value) pairs."""
+    __slots__ = ()
+
+    def __str__(self):
+        msg = ''
+        if self.lport:
+            msg = self.lport.kind[0] + 'port' + str(self.lport.number) + ': '
+        for name, pport, value in self.values:
+            msg += name + '=' + str(value) + ' '
+        return msg
+
+
 #
 #  Assertion files
 #
@@ -39,20 +81,30 @@ class AssertionsError(Exception):
 
 
 class Assertion:
+    interpreted = False  # evaluate with Calculator.calculate instead of the compiled program
+    trivial = False      # always true whatever the counter values are, so it is not checked
+    deferred = None      # the first failure (tick, diagnostic) or CalculationError of streaming, see stream_tick()
+    source_path = None   # absolute path of the assertion file, set by Ruleset.parse()
+
     def __init__(self, expr, source_file, num, log):
         self.source_file = source_file
         self.active = True
         self.multiport = False
         self.ignored = False
+        self.span = None  # (start, end) seconds of a SPAN rule
         self.log = log
         self.vars = dict()
         self.expr = expr
         self.tokens = []
-        self.tokenize()
-        self.calc = tac_calculation.Calculator(self.tokens)  # for native Python
+        positions = self.tokenize()
+        try:
+            self.calc = tac_calculation.Calculator(self.tokens)  # for native Python
+        except tac_calculation.ExpressionError as e:
+            raise self.syntax_error(e.value, positions[e.index])
         # self.calc = tac_calculation_c.Calculator()    # for c++ over Python wrapper
 
-        self.make_vars()
+        self.plans = dict()  # port mapping key -> (bindings, unmapped logical port), see plan()
+        self.bindings = []
 
     # def __eq__(self, other):
     #     return isinstance(other, self.__class__) and self.__dict__ == other.__dict__
@@ -66,238 +118,325 @@ class Assertion:
     def __hash__(self):
         return hash(os.path.abspath(self.source_file) + self.assertion_line(0))
 
-    @staticmethod
-    def split_expr(expr):
-        for const in CONSTANTS.keys():
-            expr = expr.replace(const, ' ' + const + ' ')
-        for lit in MODIFIERS.keys():
-            expr = expr.replace('@' + lit, ' @' + lit + ' ')
-        for op in OPERATORS:
-            expr = expr.replace(op, ' ' + op + ' ')
-        expr = expr.replace('> =', '>=')
-        expr = expr.replace('< =', '<=')
-        expr = expr.replace('= =', '==')
-        result = (' '.join(expr.split())).split()
-        return result
+    def __getstate__(self):
+        # only the compiled form is persisted, per-project state is not
+        state = self.__dict__.copy()
+        for name in ('log', 'values', 'plans', 'bindings', 'nodes', 'readers', 'programs', 'deferred'):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.log = None
+        self.plans = dict()
+        self.bindings = []
+
+    def copy(self, log, interpreted=False):
+        """Return a copy of this compiled assertion ready to be checked against one project."""
+        a = copy.copy(self)
+        a.log = log
+        a.active = True
+        a.ignored = False
+        a.interpreted = interpreted
+        a.trivial = False
+        a.deferred = None
+        return a
+
+    def syntax_error(self, message, pos):
+        """Return AssertionsError for the message about the expression at the position."""
+        return AssertionsError('{} at column {}: {}'.format(message, pos + 1, self.expr))
 
     def tokenize(self):
-        nport = 0
+        """Split the expression into the rule prefix and tokens and fill self.vars in a single pass. Return the
+        positions of the tokens in the expression followed by the position of its end."""
+        expr = self.expr
+        match = RULE_RX.match(expr)
+        if not match:
+            raise self.syntax_error('Bad rule prefix', len(expr) - len(expr.lstrip()))
+        self.rule_prefix = match.group(1)
+        if match.group(2):
+            self.span = int(match.group(2)), int(match.group(3))
+            if self.span[1] < self.span[0]:
+                raise self.syntax_error('Incorrect time span values', match.start(1))
         port_types = set()
-        split_expr = self.split_expr(self.expr)
-        for word in split_expr:
-            # check for constant
-            if word in CONSTANTS.keys():
-                self.tokens.append(Token('num', CONSTANTS[word]))
-                continue
-            # check for modifiers like 'sec' or 'min'
-            elif len(self.tokens) and self.tokens[-1].name == '@':
-                self.tokens.pop()
-                if word in MODIFIERS.keys():
-                    last_token = self.tokens.pop()
-                    modified_token = Token(last_token[0], last_token[1], word)
-                    self.tokens.append(modified_token)
-                else:
-                    raise AssertionsError('Incorrect modifier \'{}\': {}'.format(word, self.expr))
-                continue
-            # check for operator
-            elif word in OPERATORS:
-                self.tokens.append(Token(word, word, None))
-                continue
-            # check for rule prefixis like 'ANY', 'LAST', 'SPAN', etc.
-            match = re.match(RULE_RX, word)
-            if match:
-                rule = match.group(0)
-                match = re.match('SPAN\[(\d+):(\d+)\]', rule)
-                if match:
-                    start = int(match.group(1))
-                    end = int(match.group(2))
-                    if end >= start:
-                        self.tokens.append(Token('rule', rule, None))
-                    else:
-                        raise AssertionsError('Incorrect time span values: {}'.format(self.expr))
-                else:
-                    self.tokens.append(Token('rule', rule, None))
-                continue
-            # check for a number
-            match = re.match('\d+[.]\d+|\d+', word)
-            if match:
-                self.tokens.append(Token('num', float(word), None))
-                continue
-            # check for port prefix
-            match = re.match(COUNTER_RX, word)
-            if match:
-                port = match.group(2)
-                if not port:
-                    nport += 1
-                else:
-                    port_types.add(port)
-                self.tokens.append(Token('var', word, None))
-                continue
+        positions = []
+        pos = match.end()
+        end = len(expr.rstrip())
+        while pos < end:
+            match = TOKEN_RX.match(expr, pos)
+            if not match:
+                pos += len(expr[pos:]) - len(expr[pos:].lstrip())
+                raise self.syntax_error("Syntax error, unknown token '{}'".format(expr[pos:].split()[0]), pos)
+            pos = match.end()
+            positions.append(pos - len(match.group(0).lstrip()))
+            if match.group('num'):
+                self.tokens.append(Token('num', float(match.group('num')), None))
+            elif match.group('op'):
+                self.tokens.append(Token(match.group('op'), match.group('op'), None))
+            elif match.group('var') in CONSTANTS and not match.group('modifier'):
+                self.tokens.append(Token('num', float(CONSTANTS[match.group('var')]), None))
             else:
-                err_msg = 'Syntax error, unknown token \'{}\' in expression: {}'.format (word, self.expr)
-                raise AssertionsError(err_msg)
-        # check tokens
-        if len(self.tokens) == 0:
+                name = match.group('var')
+                modifier = match.group('modifier')
+                if modifier:
+                    if not modifier_ticks(modifier):
+                        raise self.syntax_error("Incorrect modifier '{}'".format(modifier), match.start('modifier'))
+                    # a modified counter is a variable of its own
+                    name += '@' + modifier
+                self.tokens.append(Token('var', name, modifier))
+                self.vars[name] = (self.logical_port(match.group('kind'), match.group('number')),
+                                   match.group('stat'), modifier)
+                if match.group('port'):
+                    port_types.add(match.group('port'))
+        if not self.tokens:
             raise AssertionsError('Bad syntax in expression: ' + self.expr)
 
-        # first token should be the type of rule
-        if self.tokens[0].name != 'rule' or not re.match (RULE_RX, self.tokens[0].value):
-            raise AssertionsError('Bad rule prefix in expression: ' + self.expr)
-
-
         # if sevral ports are used in expression
         self.multiport = bool(len(port_types) > 1)
-        # if self.multiport and nport:
-
-        # the first token is the rule prefix
-        self.rule_prefix = self.tokens[0].value
-
-        # save all but the first token for calculations
-        self.tokens = self.tokens[1:]
+        positions.append(end)
+        return positions
 
-    def make_vars(self):
-        # names : variable_name -> (LogicalPort, stat_name)
-        token_num = -1
-        for token in self.tokens:
-            token_num += 1
-            if token.name == 'var':
-                match = re.match(COUNTER_RX, token.value)
-                if match:
-                    port = match.group(3)
-                    port_num = match.group(5)
-                    stat_name = match.group(6)
-
-                    # if name is wildcarded (without [cs]port[0-9]+ prefix) set port to None
-                    if port_num is None and port is None:
-                        variable = (None, stat_name, token.modifier)
-                    else:
-                        if port == 'cport':
-                            port = 'client'
-                        elif port == 'sport':
-                            port = 'server'
-                        else:
-                            raise AssertionsError('Bad logical port prefix in variable name: %s' % token.value)
-                        if port_num:
-                            variable = (tac_common.LogicalPort(int(port_num), port), stat_name, token.modifier)
-                        else:
-                            variable = (tac_common.LogicalPort(None, port), stat_name, token.modifier)
-                    self.vars[token.value] = variable
-                else:
-                    raise AssertionsError('Bad variable name: %s' % token.value)
-
-                    # todo: [spashaev] add check about last rule type
     @staticmethod
-    def get_value(summaries, tick, pport, stat_name, modifier):
-        sample = summaries[tick]
-        try:
-            value = sample[pport].get(stat_name, 0.0)
-        except KeyError:
-            raise AssertionsError(("Value '{0}' not found for {1}. Check port configuration.").format(stat_name, pport))
-        if modifier:
-            mod_value = MODIFIERS.get(modifier)
-            if tick < mod_value:
-                value = value / (tick + 1) * mod_value
-            else:
-                relevant_sample = summaries[tick - mod_value]
-                value = value - relevant_sample[pport].get(stat_name, 0.0)
-        return value
+    def logical_port(kind, number):
+        """Return LogicalPort of a variable with the port prefix, None if the variable is wildcarded."""
+        if kind is None:
+            return None
+        return tac_common.LogicalPort(int(number) if number else None, 'client' if kind == 'c' else 'server')
 
-    def get_values(self, project, summaries, tick):
-        """Expand this Assertion wildcarded variables into list of dicts with values from the sample."""
-        self.values = {}
+    def make_plan(self, project):
+        """Return a pair (bindings, unmapped logical port). Bindings is a list of (logical port, binding)
+        pairs this assertion is evaluated for, where binding maps variable names to (physical port, stat name,
+        modifier). Wildcarded variables are expanded to every project port they match. If a variable refers
+        to a logical port that doesn't correspond to any physical port of the project, it is returned instead."""
+        fixed = {}
+        fixed_lport = None
         variables_to_expand_port = []
         variables_to_expand_port_number = []
-        variables_variant = {}
         for name, (lport, stat_name, modifier) in self.vars.iteritems():
             if lport is None:
-                variables_to_expand_port.append((name, modifier))
+                variables_to_expand_port.append(name)
             elif lport.number is None:
-                variables_to_expand_port_number.append((name, modifier))
+                variables_to_expand_port_number.append(name)
             else:
                 pport = project.mapping.l2p.get(lport, None)
-                # if logical port doesn't correspond to any physical port of the project - ignore this assertion
                 if pport is None:
-                    self.ignored = True # make assertion ignored
-                    self.log.info('"' + project.project.name() + '" ' + os.path.basename(self.source_file) + ' ' + self.assertion_with_port(0, str(lport)) + ' ignored')
-                    return
-                else:
-                    value = self.get_value(summaries, tick, pport, stat_name, modifier)
-                    variables_variant[name] = value
-                    self.values[lport] = variables_variant
-        if variables_to_expand_port or variables_to_expand_port_number:
-            for port in project.project:
-                pport = tac_common.PhysicalPort(port.getportnum(), port.getappliance())
-                lport = project.mapping.p2l.get(pport, None)
-                if lport is None:
-                    self.log.warning("No logical port found for %s" % pport)
-                # derive variables set and extend it with values from
-                # current physical port
-                changed = False
-                # for variables in which port is not specified, get values from any port in sample
-                for name, modifier in variables_to_expand_port:
-                    stat_name = self.vars[name][1]
-                    value = self.get_value(summaries, tick, pport, stat_name, modifier)
-                    variables_variant[name] = value
+                    return None, lport
+                fixed[name] = (pport, stat_name, modifier)
+                if fixed_lport is None:
+                    fixed_lport = lport
+        if not variables_to_expand_port and not variables_to_expand_port_number:
+            return [(fixed_lport, fixed)], None
+        bindings = []
+        for port in project.project:
+            pport = tac_common.PhysicalPort(port.getportnum(), port.getappliance())
+            lport = project.mapping.p2l.get(pport, None)
+            if lport is None:
+                self.log.warning("No logical port found for %s" % pport)
+                continue
+            # derive variables set and extend it with counters of current physical port
+            binding = dict(fixed)
+            changed = False
+            # for variables in which port is not specified, get values from any port in sample
+            for name in variables_to_expand_port:
+                binding[name] = (pport, self.vars[name][1], self.vars[name][2])
+                changed = True
+            # for variables in which port kind is specified, get values from sample only for this port kind
+            for name in variables_to_expand_port_number:
+                if self.vars[name][0].kind == lport.kind:
+                    binding[name] = (pport, self.vars[name][1], self.vars[name][2])
                     changed = True
-                # for variables in which port kind is specified, get values from sample only for this port kind
-                for name, modifier in variables_to_expand_port_number:
-                    var_lport = self.vars[name][0]
-                    stat_name = self.vars[name][1]
-                    if var_lport.kind == lport.kind:
-                        value = self.get_value(summaries, tick, pport, stat_name, modifier)
-                        variables_variant[name] = value
-                        changed = True
-                if changed:
-                    self.values[lport] = variables_variant
-
-    def check(self, project, summaries):
+            if changed:
+                bindings.append((lport, binding))
+        return bindings, None
+
+    def plan(self, project, mapping_key):
+        """Resolve variables of the assertion to counters of physical ports of the project. Plans are made
+        once per port mapping (identified by mapping_key) and shared by all copies of the assertion.
+        Return False and make the assertion ignored if the project has no port a variable refers to."""
+        plan = self.plans.get(mapping_key)
+        if plan is None:
+            plan = self.plans[mapping_key] = self.make_plan(project)
+        self.bindings, lport = plan
+        # if logical port doesn't correspond to any physical port of the project - ignore this assertion
+        if lport:
+            self.ignored = True # make assertion ignored
+            self.log.info('"' + project.project.name() + '" ' + os.path.basename(self.source_file) + ' ' + self.assertion_with_port(0, str(lport)) + ' ignored')
+            return False
+        return True
+
+    def always_true(self):
+        """Return True if the assertion holds whatever values its counters have, e.g. 'ANY 1024 > 1000'."""
+        # the last sample must fail an ANY_EXCEPT_LAST rule; variables of expressions over several ports may be
+        # undefined for some of them
+        if self.rule_prefix == 'ANY_EXCEPT_LAST' or self.multiport:
+            return False
+        bounds = self.calc.bounds(lambda name: (-tac_calculation.INFINITY, tac_calculation.INFINITY))
+        # the verdict is the integer part of the result
+        return bool(bounds) and (bounds[0] >= 1.0 or bounds[1] <= -1.0)
+
+    def verdict_key(self):
+        """Return the key of the verdict of the planned assertion: SHA-1 of the path of its assertion file,
+        expression and counters bound to its variables, so that a verdict is not reused if the rule or the port
+        mapping has changed. Bindings are sorted, as the order of ports doesn't change the verdict."""
+        bindings = sorted(sorted(binding.iteritems()) for lport, binding in self.bindings)
+        return hashlib.sha1(repr((self.source_path, self.expr, bindings))).hexdigest()
+
+    def share(self, dag):
+        """Add the expression bound to each of the planned ports to the DAG of all checked assertions."""
+        rows = self.rows(dag.size)
+        self.nodes = [(lport, dag.add(self.calc, binding, rows)) for lport, binding in self.bindings]
+
+    def rows(self, size):
+        """Return a list of (start, stop) ranges of the rows of summaries of the given size the assertion is
+        checked at: its ticks and the [0] item holding the last sample for LAST and ANY_EXCEPT_LAST rules."""
+        rows = []
+        if self.rule_prefix != 'LAST':
+            ticks = self.ticks(size - 1 if self.rule_prefix == 'ANY_EXCEPT_LAST' else size)
+            if len(ticks):
+                rows.append((ticks[0], ticks[-1] + 1))
+        if self.rule_prefix in ('LAST', 'ANY_EXCEPT_LAST'):
+            rows.append((0, 1))
+        return rows
+
+    def bind(self, dag, programs=True):
+        """Bind the planned variables to counter columns of the DAG and compile a program of the row for each
+        port unless programs is False. Sub-expressions shared with other assertions are read from the DAG."""
+        self.readers = []
+        self.programs = []
+        for (lport, binding), (lport, node) in zip(self.bindings, self.nodes):
+            readers = dict((name, dag.counter(slot)[1]) for name, slot in binding.iteritems())
+            self.readers.append((lport, readers))
+            if programs and not self.interpreted:
+                self.programs.append(dag.program(node) or self.calc.bind(readers))
+
+    def get_values(self, tick):
+        """Fill self.values with a dict of variable values from the sample for each of the bound logical ports."""
+        self.values = collections.OrderedDict()
+        for lport, readers in self.readers:
+            self.values[lport] = dict((name, reader[tick]) for name, reader in readers.iteritems())
+
+    def verdict(self, tick):
+        """Return the verdict of the assertion at the tick. The compiled program is used unless the
+        assertion is interpreted. Ports are checked until the first one the expression is false for."""
+        if self.interpreted:
+            self.get_values(tick)
+            return bool(int(self.calc.calculate(self.values, self.multiport)))
+        for program in self.programs:
+            result = program(tick)
+            if not result:
+                break
+        return bool(int(result))
+
+    def diagnose(self, tick):
+        """Return the Diagnostic of the assertion at the tick, for the port that has decided the verdict."""
+        self.get_values(tick)
+        for lport, values in self.values.iteritems():
+            if not self.calc.compile()(values):
+                break
+        names = []
+        for token in self.calc.rpn_tokens:
+            if token.name == 'var' and token.value not in names:
+                names.append(token.value)
+        slots = dict(self.bindings)[lport]
+        return Diagnostic(tick, None if self.multiport else lport,
+                          [(name, slots.get(name, (None,))[0], values.get(name)) for name in names],
+                          self.calc.explain(values))
+
+    def ticks(self, fin):
+        """Return the range of ticks before fin this multiple samples rule is checked at: the ticks of
+        seconds start..end of a SPAN rule, all of them but the [0] item holding the last sample for an
+        ANY_EXCEPT_LAST rule (it must fail there, see check_last()), all of them for other rules."""
+        if self.rule_prefix == 'ANY_EXCEPT_LAST':
+            return xrange(1, fin)
+        if self.span is None:
+            return xrange(fin)
+        # the tick is of the second (tick + 1) / 2
+        return xrange(max(0, 2 * self.span[0] - 1), min(fin, 2 * self.span[1] + 1))
+
+    def first_failure(self, fin, evaluator=None):
+        """Return the first tick before fin this assertion fails at, or None if it holds at all of them.
+        Only ticks inside the time span of a SPAN rule are evaluated."""
+        ticks = self.ticks(fin)
+        if evaluator:
+            return evaluator.first_failure(self, ticks)
+        for tick in ticks:
+            if not self.verdict(tick):
+                return tick
+        return None
+
+    def check(self, summaries, evaluator=None):
+        """Check the bound assertion against summaries using its programs or the given vectorized evaluator."""
+        if not self.bindings:
+            return
         # If the rule is related to multiple samples - then loop through all samples one by one
-        #print ("checking rule: " + self.expr)
-        passed = True
-        if self.rule_prefix in ('ANY', 'ANY_EXCEPT_LAST') or self.rule_prefix.startswith('SPAN['):
+        if self.rule_prefix != 'LAST':
             fin = len(summaries)
             if self.rule_prefix == 'ANY_EXCEPT_LAST':
                 fin -= 1
-            tick = 0
-            while passed and tick < fin:
-                sec = (tick + 1) / 2
-                self.get_values(project, summaries, tick)
-
-                result = self.calc.calculate(self.values, self.multiport)
-                res = bool(int(result[0]))
-                msg = result[1]
-                if self.rule_prefix in ('ANY', 'ANY_EXCEPT_LAST'):
-                    passed = bool(res)
-                elif self.rule_prefix.startswith('SPAN['):
-                    match = re.match('SPAN\[(\d+):(\d+)\]', self.rule_prefix)
-                    if match:
-                        start = int(match.group(1))
-                        end = int(match.group(2))
-                        if start <= sec <= end:
-                            passed = bool(res)
-                        else:
-                            passed = True
-                tick += 1
-
+            tick = self.first_failure(fin, evaluator)
+            if tick is not None:
+                self.fail((tick + 1) / 2, self.diagnose(tick))
         # If the rule is related to the last sample
-        if self.rule_prefix in ('LAST', 'ANY_EXCEPT_LAST'):
-            # get the last sample values stored in the [0] item of summaries
-            sec = len(summaries) / 2
-            self.get_values(project, summaries, 0)
-            res = self.calc.calculate(self.values, self.multiport)
-            # res = result[0]
-            msg = 'result[1]'
-            if self.rule_prefix == 'LAST':
-                passed = bool(res)
-            elif self.rule_prefix == 'ANY_EXCEPT_LAST':
-                passed = not bool(res)
+        if self.active and self.rule_prefix in ('LAST', 'ANY_EXCEPT_LAST'):
+            self.check_last(summaries, evaluator)
+
+    def stream_tick(self, tick):
+        """Check a multiple samples rule against one tick of streamed summaries. check() checks the last sample
+        in the [0] item first, which is not known yet, so the first failure or calculation error is deferred
+        until finish_stream()."""
+        if self.span and not self.span[0] <= (tick + 1) / 2 <= self.span[1]:
+            return
+        try:
+            if not self.verdict(tick):
+                self.deferred = (tick, self.diagnose(tick))
+        except tac_calculation.CalculationError as e:
+            self.deferred = e
+
+    def finish_stream(self, summaries):
+        """Report the verdict of the streamed assertion once the last sample is known, exactly as check()
+        does for the same summaries."""
+        if self.rule_prefix != 'LAST':
+            fin = len(summaries)
+            if self.rule_prefix == 'ANY_EXCEPT_LAST':
+                fin -= 1
+            ticks = self.ticks(fin)
+            if len(ticks) and ticks[0] == 0 and not self.verdict(0):
+                self.fail(0, self.diagnose(0))
+            deferred, self.deferred = self.deferred, None
+            if self.active and isinstance(deferred, tac_calculation.CalculationError):
+                raise deferred
+            if self.active and deferred:
+                self.fail((deferred[0] + 1) / 2, deferred[1])
+        if self.active and self.rule_prefix in ('LAST', 'ANY_EXCEPT_LAST'):
+            self.check_last(summaries)
+
+    def check_last(self, summaries, evaluator=None):
+        """Check a LAST or ANY_EXCEPT_LAST rule against the last sample stored in the [0] item of summaries."""
+        if evaluator:
+            res = evaluator.verdict(self, 0)
+        else:
+            res = self.verdict(0)
+        if self.rule_prefix == 'ANY_EXCEPT_LAST':
+            res = not res
+        if not res:
+            self.fail(len(summaries) / 2, self.diagnose(0))
+
+    def pending(self, tick):
+        """Return True if ticks after the given one can still make this multiple samples rule fail."""
+        if not self.active or self.deferred is not None:
+            return False
+        if self.span and self.span[0] > 0:
+            return (tick + 2) / 2 <= self.span[1]
+        return True
 
+    def fail(self, sec, diagnostic):
         time_stamp = str(datetime.timedelta(seconds=sec))
-        if not passed:
-            self.log.info\
-                (time_stamp + ' Assertion failed (\'' + self.expr + '\' in ' + os.path.basename(self.source_file) + '): ' + msg)
+        self.log.info\
+            (time_stamp + ' Assertion failed (\'' + self.expr + '\' in ' + os.path.basename(self.source_file) + '): ' + str(diagnostic))
+        for expr, value in diagnostic.subexpressions:
+            self.log.verbose('\t' + expr + ' = ' + str(value))
         # if the assertion has failed - mark it as inactive, and it will not be used in future checks
-        self.active = passed
+        self.active = False
 
     def assertion_line(self, tick):
         s = str(datetime.timedelta(seconds=tick/2)) + ' ' + self.rule_prefix + ' '
@@ -310,6 +449,199 @@ class Assertion:
         return s
 
 
+class Ruleset(object):
+    """Compiled assertions of one assertion file.
+
+    A ruleset is parsed once per process and shared by all projects. It is also pickled into CACHE_DIR,
+    keyed by file path, modification time and content hash, so that later runs skip parsing too."""
+    loaded = {}  # absolute path -> Ruleset
+
+    def __init__(self, path, mtime, size, digest, assertions):
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.digest = digest
+        self.assertions = assertions
+
+    @staticmethod
+    def cache_path(path):
+        return os.path.join(tac_common.CACHE_DIR, 'rules-' + hashlib.sha1(path).hexdigest() + '.cache')
+
+    @classmethod
+    def load(cls, file_path, log, persistent=True):
+        """Return the Ruleset for file_path, parsing the file only if no valid compiled form is cached."""
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        ruleset = cls.loaded.get(path)
+        if ruleset and ruleset.mtime == stat.st_mtime and ruleset.size == stat.st_size:
+            return ruleset
+        with open(path, 'r') as assertion_file:
+            content = assertion_file.read()
+        digest = hashlib.sha1(content).hexdigest()
+        if not ruleset or ruleset.digest != digest:
+            ruleset = None
+            if persistent:
+                cached = tac_common.load_cache(cls.cache_path(path))
+                if cached and cached.get('version') == RULESET_CACHE_VERSION and cached.get('digest') == digest:
+                    ruleset = cached['ruleset']
+                    log.verbose('Compiled assertions loaded from cache: ' + path)
+            if not ruleset:
+                ruleset = cls(path, stat.st_mtime, stat.st_size, digest, cls.parse(path, content))
+                if persistent:
+                    tac_common.save_cache(cls.cache_path(path),
+                                          {'version': RULESET_CACHE_VERSION, 'digest': digest, 'ruleset': ruleset})
+        ruleset.mtime = stat.st_mtime
+        ruleset.size = stat.st_size
+        cls.loaded[path] = ruleset
+        return ruleset
+
+    @staticmethod
+    def parse(path, content):
+        """Return a list of compiled Assertion records for the content of an assertion file."""
+        assertions = []
+        num = 0
+        for expr in content.splitlines(True):
+            num += 1
+            # ignore empty lines and comments
+            if expr in ['\n', '\r\n'] or not expr.strip() or expr[0] == '#':
+                continue
+            # remove trailing \n
+            expr = expr.rstrip('\n')
+            try:
+                a = Assertion(expr, os.path.basename(path), num, None)
+            except AssertionsError as e:
+                raise AssertionsError('{}:{}: {}'.format(os.path.basename(path), num, e))
+            a.source_path = path
+            assertions.append(a)
+        return assertions
+
+
+#
+#  Checking of planned assertions
+#
+def summary_column(summaries, slot, ranges=None):
+    """Return values of the counter of the slot (pport, stat_name, modifier) indexed by row. The rate of a
+    modifier is computed only for the list of (start, stop) ranges of rows if it is given."""
+    pport, stat_name, modifier = slot
+    column = summaries.column(pport, stat_name)
+    if not modifier:
+        return column
+    if summaries.complete:
+        return tac_summary.rate(column, modifier_ticks(modifier), ranges)
+    return tac_summary.WindowColumn(column, modifier_ticks(modifier))
+
+
+def bind_assertions(summaries, checks, engine=None):
+    """Bind the planned assertions to summaries through one expression DAG shared by all of them and
+    return the DAG. Programs are not compiled for an engine evaluating the DAG itself."""
+    dag = tac_calculation.Dag(functools.partial(summary_column, summaries), summaries.capacity(), summaries.complete)
+    for a in checks:
+        a.share(dag)
+    for a in checks:
+        a.bind(dag, engine != 'numpy')
+    return dag
+
+
+def make_evaluator(summaries, engine, dag):
+    """Return the vectorized evaluator of the bound assertions if the engine uses one, None otherwise."""
+    if engine == 'numpy':
+        return tac_vectorized.Evaluator(summaries, dag)
+    return None
+
+
+worker = dict()  # state of a pool process, see start_worker()
+
+
+def start_worker(path, layout, rows, engine):
+    """Initialize a pool process with summaries mapped from the file written by SummaryStore.export."""
+    worker['summaries'] = tac_summary.MappedStore(path, layout, rows)
+    worker['engine'] = engine
+
+
+def check_shard(shard):
+    """Check a shard of (index, assertion, bindings) in a pool process and return a list of (index, active,
+    log records, error message) for the assertions checked. Checking stops at the first error, as it does
+    in turn."""
+    summaries = worker['summaries']
+    checks = []
+    for i, a, bindings in shard:
+        a.bindings = bindings
+        a.log = tac_common.RecordingLog()
+        checks.append(a)
+    evaluator = make_evaluator(summaries, worker['engine'], bind_assertions(summaries, checks, worker['engine']))
+    results = []
+    for i, a, bindings in shard:
+        error = None
+        try:
+            a.check(summaries, evaluator)
+        except tac_calculation.CalculationError as e:
+            # the error is raised again by the parent process, exceptions of tac modules can't be unpickled
+            error = str(e)
+        results.append((i, a.active, a.log.records, error))
+        if error:
+            break
+    return results
+
+
+class CounterCatalog(object):
+    """Answers of swifttest.Stats.counter_exists memoized for the process.
+
+    The catalog is also pickled into CACHE_DIR per swifttest API version, see api_version(), so that later
+    runs ask the API only about counters they haven't seen yet."""
+    catalog = None  # the catalog of the process
+
+    def __init__(self, version, path):
+        self.version = version
+        self.path = path         # cache file or None if the catalog is not persisted
+        self.counters = dict()   # stat name -> True if the counter exists
+        self.changed = False
+
+    @staticmethod
+    def api_version():
+        """Return swifttest.__version__ or, if the API has none, the path, size and modification time of the
+        swifttest module file, which change with the API; None if neither is known."""
+        version = getattr(swifttest, '__version__', None)
+        if version is not None:
+            return version
+        try:
+            path = os.path.realpath(swifttest.__file__)
+            stat = os.stat(path)
+        except (AttributeError, EnvironmentError):
+            return None
+        return path, stat.st_size, stat.st_mtime
+
+    @staticmethod
+    def cache_path(version):
+        return os.path.join(tac_common.CACHE_DIR, 'counters-' + hashlib.sha1(str(version)).hexdigest() + '.cache')
+
+    @classmethod
+    def get(cls, persistent=True):
+        """Return the catalog of the process, loading it from the cache if persistent."""
+        if cls.catalog is None:
+            version = cls.api_version()
+            catalog = cls(version, cls.cache_path(version) if persistent and version else None)
+            if catalog.path:
+                cached = tac_common.load_cache(catalog.path)
+                if cached and cached.get('version') == version:
+                    catalog.counters.update(cached['counters'])
+            cls.catalog = catalog
+        return cls.catalog
+
+    def exists(self, stat_name):
+        """Return True if the counter is known to swifttest."""
+        exists = self.counters.get(stat_name)
+        if exists is None:
+            exists = self.counters[stat_name] = bool(swifttest.Stats.counter_exists(stat_name))
+            self.changed = True
+        return exists
+
+    def save(self):
+        """Persist the catalog if new counters have been checked."""
+        if self.changed and self.path:
+            tac_common.save_cache(self.path, {'version': self.version, 'counters': self.counters})
+        self.changed = False
+
+
 class Assertions:
     def __init__(self, project, log):
         self.project = project
@@ -318,7 +650,9 @@ class Assertions:
         self.load_assertions()
         self.summary_files = list()
         self.counters = set()
-        self.summaries = list()
+        self.summaries = tac_summary.SummaryStore()
+        self.checked = False
+        self.recorded = []  # (verdict key, assertion) of assertions logging into a RecordingLog, see reuse_verdicts()
 
     def load_assertions(self):
         """Return list of Assertion records for project_dir."""
@@ -342,48 +676,43 @@ class Assertions:
             raise AssertionsError(err_msg)
         self.log.verbose("Loading assertions...")
         self.log.verbose (files)
+        persistent = not self.project.params.no_cache
+        interpreted = self.project.params.engine == 'interpreter'
         for file_path in files:
             try:
-                with open(file_path, 'r') as assertion_file:
-                    num = 0
-                    for expr in assertion_file:
-                        num += 1
-                        # ignore empty lines and comments
-                        if expr in ['\n', '\r\n'] or not expr.strip() or expr[0] == '#':
-                            continue
-                           # remove trailing \n
-                        expr = expr.rstrip('\n')
-                        a = Assertion(expr, os.path.basename(file_path), num, self.log)
-                        self.assertions.append(a)
-                    self.log.verbose('Assertions loaded: ' + file_path)
+                ruleset = Ruleset.load(file_path, self.log, persistent)
+                self.assertions.extend(a.copy(self.log, interpreted) for a in ruleset.assertions)
+                self.log.verbose('Assertions loaded: ' + file_path)
             except Exception as e:
                 self.log.error("Failed to load assertions file: " + file_path)
                 raise AssertionsError(str(e))
 
+    def index_counters(self):
+        """Return an inverted index: stat name -> list of assertions referring to the counter."""
+        index = collections.defaultdict(list)
+        for a in self.assertions:
+            for lport, stat_name, modifier in a.vars.itervalues():
+                index[stat_name].append(a)
+        return index
+
     def get_counters(self):
         """ Check all statistic keys in assertions for validity, make a list of valid counters, make invalid assertions ignored. """
         # If no summary files found - raise exception
         if len(self.summary_files) == 0:
             raise AssertionsError('Summary files not found.')
+        catalog = CounterCatalog.get(not self.project.params.no_cache)
         ignored_counters = set()
         ignore_assertions_count = 0
-        # test each summary counter for validity
-        for a in self.assertions:
-            a_ignored = False
-            for name, (lport, stat_name, modifier) in a.vars.iteritems():
-                test_cnt = set()
-                match = re.match(COUNTER_RX, name)
-                if match:
-                    name = match.group(6)
-                test_cnt.add(name)
-                # test this counter
-                # if counter is invalid - ignore the whole assertion expression
-                if not swifttest.Stats.counter_exists(name):
-                    a.ignored = True
-                    a_ignored = True
-                    ignored_counters.add(stat_name)
-            if a_ignored:
-                ignore_assertions_count += 1
+        # test each counter once for validity
+        for stat_name, assertions in self.index_counters().iteritems():
+            # if counter is invalid - ignore the whole assertion expression of all assertions using it
+            if not catalog.exists(stat_name):
+                ignored_counters.add(stat_name)
+                for a in assertions:
+                    if not a.ignored:
+                        a.ignored = True
+                        ignore_assertions_count += 1
+        catalog.save()
         # output of ignored counters
         if len(ignored_counters):
             if ignore_assertions_count > 1:
@@ -404,18 +733,127 @@ class Assertions:
                     self.log.error("<...> Total " + str(len(ignored_counters)) + " items.")
                     break
 
-    def load_summaries(self):
-        """Make a map (physical_port -> summary generator) for stats."""
+    def prune(self):
+        """Don't check planned assertions which are always true, they are reported as passed."""
+        pruned = 0
+        for a in self.assertions:
+            if a.active and not a.ignored and a.bindings and a.always_true():
+                a.trivial = True
+                a.bindings = []
+                pruned += 1
+                self.log.verbose('Always true: ' + a.expr)
+        self.log.info('Assertions pruned as always true: %d' % pruned)
+
+    def make_plans(self):
+        """Resolve variables of active assertions to counters of physical ports once for the project."""
+        # assertions loaded from the same ruleset share plans, a plan is reused for projects with the same ports
+        mapping = self.project.mapping
+        mapping_key = (tuple(sorted(mapping.l2p.iteritems())),
+                       tuple(tac_common.PhysicalPort(port.getportnum(), port.getappliance()) for port in self.project.project))
+        planned = 0
+        for a in self.assertions:
+            if a.active and not a.ignored and a.plan(self.project, mapping_key):
+                planned += 1
+        self.log.verbose('Assertions planned: %d' % planned)
+
+    def history(self):
+        """Return the number of the last rows needed to check the planned assertions tick by tick: the longest
+        rate window, one row more for ANY_EXCEPT_LAST rules which are checked one row behind and the current one."""
+        window = 0
+        for a in self.assertions:
+            if a.active and not a.ignored:
+                for lport, stat_name, modifier in a.vars.itervalues():
+                    if modifier:
+                        window = max(window, modifier_ticks(modifier))
+        return window + 2
+
+    def bind(self, checks, engine=None):
+        """Bind the planned assertions to summaries through one expression DAG shared by all of them and
+        return the DAG."""
+        dag = bind_assertions(self.summaries, checks, engine)
+        self.log.verbose('Sub-expressions shared: %d' % dag.shared_count())
+        return dag
+
+    def check_parallel(self, checks, jobs):
+        """Check the planned assertions in a pool of processes which share summaries through a memory-mapped
+        file. Failures are logged in the order of assertions, the same as checking them in turn does."""
+        # unknown ports are reported before anything is checked, as bind() does
+        for a in checks:
+            for lport, binding in a.bindings:
+                for pport, stat_name, modifier in binding.itervalues():
+                    self.summaries.port(pport, stat_name)
+        mapped = isinstance(self.summaries, tac_summary.MappedStore)
+        if mapped:
+            # summaries mapped from the summary cache are shared through the cache file itself
+            path, layout = self.summaries.path, self.summaries.layout
+        else:
+            handle, path = tempfile.mkstemp(prefix='tac-', suffix='.columns')
+            os.close(handle)
+        try:
+            if not mapped:
+                layout = self.summaries.export(path)
+            size = max(1, len(checks) / (jobs * 4))
+            shards = [[(i, checks[i], checks[i].bindings) for i in xrange(start, min(start + size, len(checks)))]
+                      for start in xrange(0, len(checks), size)]
+            pool = multiprocessing.Pool(jobs, start_worker, (path, layout, len(self.summaries), self.project.params.engine))
+            try:
+                for results in pool.imap(check_shard, shards):
+                    for i, active, records, error in results:
+                        for level, message in records:
+                            getattr(checks[i].log, level)(message)
+                        if error:
+                            raise tac_calculation.CalculationError(error)
+                        checks[i].active = active
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        finally:
+            if not mapped:
+                os.remove(path)
+
+    def used_counters(self):
+        """Return a set of stat names referenced by assertions to be checked."""
+        counters = set()
+        for a in self.assertions:
+            if a.active and not a.ignored and a.bindings:
+                for lport, stat_name, modifier in a.vars.itervalues():
+                    counters.add(stat_name)
+        return counters
+
+    @staticmethod
+    def available_counters(summary):
+        """Return a set of stat names found in the first sample of the summary."""
+        # an empty set of counters makes swifttest decode all of them
+        for counters in summary.each_counters(set()):
+            return set(counters)
+        return set()
+
+    def plan(self):
+        """Plan assertions against the summary files of the project and return True if they use any counters."""
         # Make a unique list of statistics counters used in list of assertions
         self.summary_files = tac_common.get_files(self.project.results_dir, SUMMARY_FILE_RX)
         self.get_counters()
+        self.make_plans()
+        self.prune()
+        self.reuse_verdicts()
+        self.counters = self.used_counters()
+        if not self.counters:
+            self.log.info('No counters are used by assertions, summary files are not loaded.')
+            return False
+        return True
 
+    def open_summaries(self):
+        """Return a map (physical_port -> summary generator) for stats used by assertions."""
         self.log.info('Loading summary files...')
 
         # Make a list of dictionary generators from summary files using swifttest API
         # Include only needed counters
         generator = {}
-        end = {}
+        decoded = 0
+        skipped = 0
         for sf in self.summary_files:
             self.log.verbose(sf)
             # Open summary file.
@@ -424,29 +862,184 @@ class Assertions:
             appliance_ip = match.group(3)
             port_number = int(match.group(4))
             pport = tac_common.PhysicalPort(port_number, appliance_ip)
+            available = self.available_counters(summary)
+            decoded += len(available & self.counters)
+            skipped += len(available - self.counters)
             generator[pport] = summary.each_counters(self.counters)
-        # Get all counter values from all generators that have not ended yet and put them into self.summaries dict
-        while True:
-            sample = {}
-            for pport in generator:
-                try:
-                    sample[pport] = next(generator[pport])
-                except StopIteration:
-                    if not pport in end.keys():
-                        end[pport] = self.summaries[-1][pport]
-                    sample[pport] = {}
-            if len(end) == len(generator):
+        self.log.info('Counters decoded: %d, skipped: %d (in %d summary files)' % (decoded, skipped, len(generator)))
+        return generator
+
+    def summary_cache_key(self):
+        """Return the key the summary cache is valid for: name, size and modification time of summary files."""
+        key = []
+        for sf in sorted(self.summary_files):
+            stat = os.stat(sf)
+            key.append([os.path.basename(sf), stat.st_size, stat.st_mtime])
+        return key
+
+    def load_summary_cache(self):
+        """Map summaries from the summary cache of the results directory and return True, or return False if
+        the cache is missing, the summary files have changed since it was written or it lacks used counters."""
+        path = os.path.join(self.project.results_dir, SUMMARY_CACHE_FILE)
+        cached = tac_common.load_json_cache(path + '.cache')
+        try:
+            if cached.get('version') != SUMMARY_CACHE_VERSION or cached['key'] != self.summary_cache_key() or \
+                    not self.counters <= set(cached['counters']):
+                return False
+            # JSON has no tuple keys: the layout is a list of [[port number, appliance ip], {stat_name: offset}]
+            layout = dict((tac_common.PhysicalPort(*pport), offsets) for pport, offsets in cached['layout'])
+            self.summaries = tac_summary.MappedStore(path + '.columns', layout, cached['rows'])
+        except (EnvironmentError, ValueError):
+            # the columns file is missing or shorter than the layout
+            return False
+        except (AttributeError, KeyError, TypeError):
+            # the cache is missing or malformed
+            return False
+        self.log.info('Summaries mapped from cache: ' + path + '.columns')
+        return True
+
+    def save_summary_cache(self, key):
+        """Write the summary store into the summary cache of the results directory. The header is written
+        last, so that an interrupted write leaves no valid cache; failures are not fatal."""
+        path = os.path.join(self.project.results_dir, SUMMARY_CACHE_FILE)
+        try:
+            if os.path.exists(path + '.cache'):
+                os.remove(path + '.cache')
+            layout = self.summaries.export(path + '.columns.tmp')
+            # a new file is never seen through a mapping of the old one by another process
+            if os.path.exists(path + '.columns'):
+                os.remove(path + '.columns')
+            os.rename(path + '.columns.tmp', path + '.columns')
+        except EnvironmentError as e:
+            self.log.verbose('Summary cache is not saved: ' + str(e))
+            return
+        tac_common.save_json_cache(path + '.cache', {'version': SUMMARY_CACHE_VERSION, 'key': key,
+                                                     'counters': sorted(self.counters),
+                                                     'layout': [[list(pport), offsets]
+                                                                for pport, offsets in layout.iteritems()],
+                                                     'rows': len(self.summaries)})
+
+    def summaries_digest(self):
+        """Return SHA-1 of the key of the summary cache identifying the summary files."""
+        return hashlib.sha1(repr(self.summary_cache_key())).hexdigest()
+
+    def reuse_verdicts(self):
+        """Apply verdicts cached in the results directory to planned assertions, which are then not checked.
+
+        Verdicts are cached per (summaries digest, Assertion.verdict_key()), so that only new or changed
+        assertions are checked against the same summaries again. Log records of the planned assertions are
+        kept and logged in the order of assertions by log_verdicts()."""
+        if self.project.params.no_cache:
+            return
+        cached = tac_common.load_json_cache(os.path.join(self.project.results_dir, VERDICT_CACHE_FILE))
+        verdicts = dict()
+        if isinstance(cached, dict) and cached.get('version') == VERDICT_CACHE_VERSION and \
+                cached.get('summaries') == self.summaries_digest():
+            verdicts = cached['verdicts']
+        reused = 0
+        for a in self.assertions:
+            if a.active and not a.ignored and a.bindings:
+                key = a.verdict_key()
+                a.log = tac_common.RecordingLog()
+                self.recorded.append((key, a))
+                if key in verdicts:
+                    a.active, a.log.records = verdicts[key][0], list(verdicts[key][1])
+                    a.bindings = []
+                    reused += 1
+        self.log.info('Verdicts reused: %d' % reused)
+
+    def log_verdicts(self):
+        """Log the records of assertions kept by reuse_verdicts()."""
+        for key, a in self.recorded:
+            for level, message in a.log.records:
+                getattr(self.log, level)(message)
+
+    def save_verdicts(self):
+        """Log the records of assertions kept by reuse_verdicts() and cache their verdicts in the results
+        directory; failures to write the cache are not fatal."""
+        self.log_verdicts()
+        if not self.recorded:
+            return
+        verdicts = dict((key, [a.active, a.log.records]) for key, a in self.recorded)
+        for key, a in self.recorded:
+            a.log = self.log
+        self.recorded = []
+        tac_common.save_json_cache(os.path.join(self.project.results_dir, VERDICT_CACHE_FILE),
+                                   {'version': VERDICT_CACHE_VERSION, 'summaries': self.summaries_digest(),
+                                    'verdicts': verdicts})
+
+    def load_summaries(self):
+        """Load summaries into the summary store. They are mapped from the summary cache of the results
+        directory if summary files haven't changed since they were loaded, and cached there otherwise."""
+        if not self.plan():
+            return
+        persistent = not self.project.params.no_cache
+        if persistent and self.load_summary_cache():
+            return
+        # summary files changed while they are decoded invalidate the cache
+        key = self.summary_cache_key()
+        # Get all counter values from all generators that have not ended yet and put them into the summary store
+        self.summaries.load(self.open_summaries())
+        if persistent:
+            self.save_summary_cache(key)
+
+    def stream_summaries(self):
+        """Check assertions against each sample as soon as it is decoded from summaries. Only the history
+        needed by modifiers and the last sample of each port are kept, so memory does not grow with the
+        duration of the test."""
+        if not self.plan():
+            return
+        generator = self.open_summaries()
+        self.checked = True
+        try:
+            self.stream_checks(generator)
+        except:
+            self.log_verdicts()
+            raise
+
+    def stream_checks(self, generator):
+        """Check planned assertions against each sample from the map (physical_port -> summary generator)."""
+        self.summaries = tac_summary.RollingStore(self.history())
+        self.log.verbose("Checking assertions while loading summaries...")
+        checks = [a for a in self.assertions if a.active and not a.ignored and a.bindings]
+        self.bind(checks)
+        each_tick = [a for a in checks if a.rule_prefix != 'LAST']
+        # rules checked against the last sample in the [0] item of summaries, which is known at the end only
+        last_sample = [a for a in checks if a.rule_prefix in ('LAST', 'ANY_EXCEPT_LAST') or len(a.ticks(1))]
+        for row in self.summaries.stream(generator):
+            for a in each_tick:
+                # the last row is not known yet, so ANY_EXCEPT_LAST rules are checked one row behind
+                tick = row - 1 if a.rule_prefix == 'ANY_EXCEPT_LAST' else row
+                if tick > 0:
+                    a.stream_tick(tick)
+            each_tick = [a for a in each_tick if a.pending(row)]
+            if not each_tick and not last_sample:
+                self.log.info('All assertions are decided at %s, the rest of summaries is skipped.' %
+                              datetime.timedelta(seconds=(row + 1) / 2))
                 break
-            self.summaries.append(sample)
-        self.summaries.insert(0, end)
+        # failures are reported in the order of assertions, as check() does
+        for a in checks:
+            a.finish_stream(self.summaries)
 
     def passed(self):
         """Print assertions summary report and return True if passed, false - otherwise."""
-        self.log.verbose("Checking assertions...")
-        n = 0
-        for a in self.assertions:
-            if a.active and not a.ignored:
-                a.check(self.project, self.summaries)
+        if not self.checked:
+            self.log.verbose("Checking assertions...")
+            checks = [a for a in self.assertions if a.active and not a.ignored and a.bindings]
+            jobs = min(self.project.params.jobs, len(checks))
+            try:
+                if jobs > 1:
+                    self.log.verbose('Checking assertions in %d processes...' % jobs)
+                    self.check_parallel(checks, jobs)
+                else:
+                    evaluator = make_evaluator(self.summaries, self.project.params.engine,
+                                               self.bind(checks, self.project.params.engine))
+                    for a in checks:
+                        a.check(self.summaries, evaluator)
+            except:
+                self.log_verdicts()
+                raise
+        self.save_verdicts()
         assertion_files = set()
         result = True
         for a in self.assertions:
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+import argparse
+import random
+import time
+
+import tac_assertions
+import tac_common
+
+#
+# Micro-benchmarks of assertion processing, run from the repository root:
+#   python tac_bench.py [-n ITERATIONS] [assertion files]
+#
+LPORT = tac_common.LogicalPort(1, 'client')
+
+
+def read(files):
+    """Return a list of (path, content) of the assertion files."""
+    contents = []
+    for file_path in files:
+        with open(file_path, 'r') as assertion_file:
+            contents.append((file_path, assertion_file.read()))
+    return contents
+
+
+def load(contents):
+    """Return a list of compiled Assertion records from the assertion files contents."""
+    assertions = []
+    for file_path, content in contents:
+        assertions.extend(tac_assertions.Ruleset.parse(file_path, content))
+    return assertions
+
+
+def measure(name, function, samples, iterations):
+    """Call function(assertion, values) for all samples the given number of times and print the timing."""
+    start = time.time()
+    for i in xrange(iterations):
+        for assertion, values in samples:
+            function(assertion, values)
+    elapsed = time.time() - start
+    print '%-12s %8.3f s  %8.3f us/evaluation' % (name, elapsed, elapsed * 1e6 / (iterations * len(samples)))
+    return elapsed
+
+
+def bench_evaluation(assertions, iterations):
+    """Compare Calculator.calculate with compiled programs on random values of the assertion variables."""
+    random.seed(0)
+    samples = []
+    for a in assertions:
+        samples.append((a, dict((name, float(random.randint(0, 3))) for name in a.vars)))
+    for a in assertions:
+        a.calc.compile()
+    print 'Evaluation of %d assertions, %d iterations:' % (len(assertions), iterations)
+    interpreted = measure('interpreter', lambda a, values: a.calc.calculate({LPORT: values}, a.multiport),
+                          samples, iterations)
+    compiled = measure('compiled', lambda a, values: a.calc.compile()(values), samples, iterations)
+    print 'Speed-up: %.1fx' % (interpreted / compiled)
+
+
+def bench_parsing(contents, iterations):
+    """Measure parsing of the assertion files without the ruleset cache."""
+    count = len(load(contents))
+    iterations = max(1, iterations / 20)
+    start = time.time()
+    for i in xrange(iterations):
+        load(contents)
+    elapsed = time.time() - start
+    print 'Parsing of %d assertions, %d iterations:' % (count, iterations)
+    print '%-12s %8.3f s  %8.3f us/assertion  %8.0f assertions/s' % ('parser', elapsed, elapsed * 1e6 / (iterations * count),
+                                                                      iterations * count / elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of assertion processing.')
+    parser.add_argument('files', nargs='*', default=['integrity.assertions'], help='assertion files')
+    parser.add_argument('-n', '--iterations', type=int, default=200, help='number of iterations')
+    args = parser.parse_args()
+    contents = read(args.files)
+    bench_parsing(contents, args.iterations)
+    bench_evaluation(load(contents), args.iterations)
+
+
+if __name__ == '__main__':
+    main()
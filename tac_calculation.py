@@ -1,3 +1,6 @@
+import array
+import collections
+
 LEFT_ASSOC = 0
 RIGHT_ASSOC = 1
 
@@ -21,6 +24,27 @@ OPERATORS = {
     '|'  : (14, LEFT_ASSOC)
 }
 
+# Python code of operators for compiled programs; other operators are left to Calculator.binary_op
+COMPILED_OPERATORS = {
+    '*'  : '(%s * %s)',
+    '/'  : 'div(%s, %s)',
+    '%'  : 'mod(%s, %s)',
+    '+'  : '(%s + %s)',
+    '-'  : '(%s - %s)',
+    '<'  : '(%s < %s)',
+    '<=' : '(%s <= %s)',
+    '>'  : '(%s > %s)',
+    '>=' : '(%s >= %s)',
+    '==' : '(%s == %s)',
+    '!=' : '(%s != %s)',
+    '&'  : '(%s and %s)',
+    '|'  : '(%s or %s)'
+}
+SHORT_CIRCUIT = {'&': False, '|': True}  # operator -> truth of the left operand which decides the result
+UNDEFINED_VALUE = -1.0  # value of a variable which is not defined for the port
+INFINITY = float('inf')
+SHARED_MIN_OPERATORS = 2  # smaller sub-expressions are cheaper to evaluate again than to look up
+
 
 
 #
@@ -34,13 +58,63 @@ class CalculationError(Exception):
         return str(self.value)
 
 
+class ExpressionError(CalculationError):
+    """Syntax error of the token at the index in the infix tokens, len(tokens) for the end of the expression."""
+
+    def __init__(self, value, index):
+        CalculationError.__init__(self, value)
+        self.index = index
+
+
+def div(a, b):
+    if b == 0.0:
+        raise CalculationError('Division by zero')
+    return a / b
+
+
+def mod(a, b):
+    if b == 0.0:
+        raise CalculationError('Division by zero')
+    return a % b
+
+
+def merge_ranges(ranges):
+    """Return a sorted list of disjoint (start, stop) ranges covering the same rows as the given ones."""
+    merged = []
+    for start, stop in sorted(ranges):
+        if start >= stop:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def operator_source(op, a, b):
+    """Return Python source of the operator applied to sources a and b."""
+    if op in COMPILED_OPERATORS:
+        return COMPILED_OPERATORS[op] % (a, b)
+    return 'binary_op(%r, %s, %s)' % (op, a, b)
+
+
 class Calculator:
+    program = None
+
     def __init__(self, tokens):
         self.rpn_tokens = []
         self.infix_to_rpn(tokens)
+        self.rpn_tokens = self.fold(self.rpn_tokens)
+        self.jumps = self.make_jumps(self.rpn_tokens)
         self.multiport = False
         # convert tokens into postfix notation (aka RPN)
 
+    def __getstate__(self):
+        # compiled programs are not pickled, they are compiled again when needed
+        state = self.__dict__.copy()
+        state.pop('program', None)
+        return state
+
     @staticmethod
     def is_operator(token):
         return token.name in OPERATORS.keys()
@@ -56,9 +130,15 @@ class Calculator:
         return OPERATORS[token2.name][PRIORITY] - OPERATORS[token1.name][PRIORITY]
 
     def infix_to_rpn(self, tokens):
+        """Convert infix tokens into rpn_tokens. Operands and operators must alternate and brackets match,
+        otherwise ExpressionError is raised for the offending token."""
         stack = []
-        for token in tokens:
+        opening = []  # indices of the open brackets in the stack
+        operand = True  # an operand is expected next
+        for i, token in enumerate(tokens):
             if self.is_operator(token):
+                if operand:
+                    raise ExpressionError("Missing operand before '%s'" % token.value, i)
                 while len(stack) != 0 and self.is_operator(stack[-1]):
                     if ((self.is_associative(token, LEFT_ASSOC) and self.cmp_precedence(token, stack[-1]) <= 0) or
                             (self.is_associative(token, RIGHT_ASSOC) and self.cmp_precedence(token, stack[-1]) < 0)):
@@ -66,17 +146,138 @@ class Calculator:
                         continue
                     break
                 stack.append(token)
+                operand = True
             elif token.value == '(':
+                if not operand:
+                    raise ExpressionError("Missing operator before '('", i)
                 stack.append(token)
+                opening.append(i)
             elif token.value == ')':
-                while len(stack) != 0 and stack[-1].value != '(':
+                if not opening:
+                    raise ExpressionError("Unmatched ')'", i)
+                if operand:
+                    raise ExpressionError("Missing operand before ')'", i)
+                while stack[-1].value != '(':
                     self.rpn_tokens.append(stack.pop())
                 stack.pop()
+                opening.pop()
             else:
+                if not operand:
+                    raise ExpressionError('Missing operator', i)
                 self.rpn_tokens.append(token)
+                operand = False
+        if opening:
+            raise ExpressionError("Unmatched '('", opening[-1])
+        if operand:
+            raise ExpressionError('Missing operand at the end', len(tokens))
         while len(stack) != 0:
             self.rpn_tokens.append(stack.pop())
 
+    @staticmethod
+    def fold(rpn_tokens):
+        """Return rpn_tokens with constant sub-expressions computed, & and | with a constant left operand
+        resolved and identities (x + 0, x - 0, x * 1, x / 1) removed. Sub-expressions which raise an error
+        are left as they are, so that the error is raised when the expression is evaluated."""
+        stack = []  # (tokens, constant value or None)
+        for token in rpn_tokens:
+            if token.name == 'var':
+                stack.append(([token], None))
+            elif token.name == 'num':
+                stack.append(([token], float(token.value)))
+            else:
+                b_tokens, b = stack.pop()
+                a_tokens, a = stack.pop()
+                if a is not None and b is not None:
+                    try:
+                        value = float(Calculator.binary_op(token.name, a, b))
+                        stack.append(([token._replace(name='num', value=value, modifier=None)], value))
+                        continue
+                    except CalculationError:
+                        pass
+                elif a is not None and token.name in SHORT_CIRCUIT:
+                    stack.append((a_tokens, a) if bool(a) == SHORT_CIRCUIT[token.name] else (b_tokens, b))
+                    continue
+                elif (b == 0.0 and token.name in ('+', '-')) or (b == 1.0 and token.name in ('*', '/')):
+                    stack.append((a_tokens, a))
+                    continue
+                elif (a == 0.0 and token.name == '+') or (a == 1.0 and token.name == '*'):
+                    stack.append((b_tokens, b))
+                    continue
+                stack.append((a_tokens + b_tokens + [token], None))
+        return stack[0][0]
+
+    def bounds(self, variable):
+        """Return (lowest, highest) value the expression can give if each variable is within the bounds
+        variable(name) returns, or None if they can't be found, e.g. because the expression can raise."""
+        stack = []
+        for token in self.rpn_tokens:
+            if token.name == 'var':
+                stack.append(variable(token.value))
+            elif token.name == 'num':
+                stack.append((float(token.value), float(token.value)))
+            elif len(stack) < 2:
+                return None
+            else:
+                (b_low, b_high), (a_low, a_high) = stack.pop(), stack.pop()
+                op = token.name
+                if op == '+':
+                    stack.append((a_low + b_low, a_high + b_high))
+                elif op == '-':
+                    stack.append((a_low - b_high, a_high - b_low))
+                elif op in ('<', '<=', '>', '>=', '==', '!='):
+                    if op in ('<', '<='):
+                        (a_low, a_high), (b_low, b_high) = (b_low, b_high), (a_low, a_high)
+                        op = '>' if op == '<' else '>='
+                    if op == '>=':
+                        always, never = a_low >= b_high, a_high < b_low
+                    elif op == '>':
+                        always, never = a_low > b_high, a_high <= b_low
+                    elif op == '==':
+                        always, never = a_low == a_high == b_low == b_high, a_high < b_low or b_high < a_low
+                    else:
+                        always, never = a_high < b_low or b_high < a_low, a_low == a_high == b_low == b_high
+                    stack.append((1.0, 1.0) if always else (0.0, 0.0) if never else (0.0, 1.0))
+                elif op in SHORT_CIRCUIT:
+                    # the result is the left operand if its truth decides the result, the right one otherwise
+                    a_true = a_low > 0.0 or a_high < 0.0
+                    a_false = a_low == a_high == 0.0
+                    if a_true == SHORT_CIRCUIT[op] and (a_true or a_false):
+                        stack.append((a_low, a_high))
+                    elif a_true or a_false:
+                        stack.append((b_low, b_high))
+                    else:
+                        stack.append((min(a_low, b_low), max(a_high, b_high)))
+                else:
+                    return None
+        if len(stack) != 1:
+            return None
+        return stack[0]
+
+    @staticmethod
+    def make_jumps(rpn_tokens):
+        """Return a map (index of the last token of the left operand of & or | -> index of the operator) used
+        to skip the right operand when the left one decides the result."""
+        jumps = dict()
+        starts = []  # index of the first token of each operand on the stack
+        for i, token in enumerate(rpn_tokens):
+            if token.name in ('var', 'num'):
+                starts.append(i)
+            elif len(starts) > 1:
+                b_start = starts.pop()
+                if token.name in SHORT_CIRCUIT:
+                    jumps[b_start - 1] = i
+        return jumps
+
+    def short_circuit(self, i, stack):
+        """Return the index of the operator to continue after if the value on top of the stack, the left operand
+        of & or | ending at the token i, decides its result, otherwise return i. The result of the skipped
+        operator may be the left operand of the next one."""
+        op = self.jumps.get(i)
+        while op is not None and stack and bool(stack[-1]) == SHORT_CIRCUIT[self.rpn_tokens[op].name]:
+            i = op
+            op = self.jumps.get(i)
+        return i
+
     @staticmethod
     def value(token, variables):
         if token.name == 'var':
@@ -106,6 +307,8 @@ class Calculator:
                 raise CalculationError('Division by zero')
             return a / b
         elif op == '%':
+            if b == 0.0:
+                raise CalculationError('Division by zero')
             return a % b
         elif op == '+':
             return a + b
@@ -134,15 +337,16 @@ class Calculator:
         """Execute the operation against rpn_tokens"""
         # if multiple logical ports are evaluated in expression
         stack = []
+        tokens = self.rpn_tokens
         if multiport > 1:
-            msg = ''
-            for token in self.rpn_tokens:
+            i = 0
+            while i < len(tokens):
+                token = tokens[i]
                 if token.name == 'var':
                     for port_values in values.iteritems():
                         val = self.value(token, port_values[1])
                         if val != -1:
                             stack.append(val)
-                            msg += str(token.value) + '=' + str(val) + ' '
                             break
                 elif token.name == 'num':
                     stack.append(float(token.value))
@@ -155,20 +359,17 @@ class Calculator:
                             a = stack.pop()
                             op_result = self.binary_op(token.name, a, b)
                             stack.append(op_result)
+                i = self.short_circuit(i, stack) + 1
 
         # if the expression compares values within one and the same port
         else:
             for port_values in values.iteritems():
-                msg = ''
                 stack = []
-                if multiport == 0:
-                    msg = port_values[0].kind[0] + 'port' + str(port_values[0].number) + ': '
-                for token in self.rpn_tokens:
+                i = 0
+                while i < len(tokens):
+                    token = tokens[i]
                     if token.name == 'var':
-                        val = self.value(token, port_values[1])
-                        stack.append(val)
-                        msg += str(token.value) + '=' + str(val) + ' '
-
+                        stack.append(self.value(token, port_values[1]))
                     elif token.name == 'num':
                         stack.append(float(token.value))
                     else:
@@ -179,8 +380,216 @@ class Calculator:
                             a = stack.pop()
                             op_result = self.binary_op(token.name, a, b)
                             stack.append(op_result)
-                if not op_result:
+                    i = self.short_circuit(i, stack) + 1
+                if not stack[-1]:
                     break
         result = stack.pop()
         # print ("RETURN: " + str (result))
-        return result, msg
+        return result
+
+    def explain(self, values):
+        """Return a list of (sub-expression, value) pairs for every operator of rpn_tokens evaluated with
+        the dict of variable values of one port. Used to describe failures only, so it is not optimized."""
+        stack = []
+        subexpressions = []
+        for token in self.rpn_tokens:
+            if token.name == 'var':
+                stack.append((token.value, self.value(token, values)))
+            elif token.name == 'num':
+                stack.append((str(token.value), float(token.value)))
+            else:
+                b, b_value = stack.pop()
+                a, a_value = stack.pop()
+                try:
+                    value = self.binary_op(token.name, a_value, b_value)
+                except CalculationError as e:
+                    value = str(e)
+                expr = '(%s %s %s)' % (a, token.name, b)
+                subexpressions.append((expr[1:-1], value))
+                stack.append((expr, value))
+        return subexpressions
+
+    def generate(self, variable):
+        """Return Python source of the expression with variables replaced by variable(name) source."""
+        stack = []
+        for token in self.rpn_tokens:
+            if token.name == 'var':
+                stack.append(variable(token.value))
+            elif token.name == 'num':
+                stack.append(repr(float(token.value)))
+            else:
+                b = stack.pop()
+                a = stack.pop()
+                stack.append(operator_source(token.name, a, b))
+        return stack[-1]
+
+    @staticmethod
+    def namespace():
+        return {'div': div, 'mod': mod, 'binary_op': Calculator.binary_op}
+
+    def compile(self):
+        """Return rpn_tokens compiled into a Python function of a dict of variable values of one port.
+        It gives the same result as calculate() does for the port: constants are converted and operators
+        are resolved once, at compile time."""
+        if self.program:
+            return self.program
+        try:
+            self.program = eval('lambda values: ' + self.generate(lambda name: 'values.get(%r, %r)' % (name, UNDEFINED_VALUE)),
+                                self.namespace())
+        except (SyntaxError, MemoryError, RuntimeError):
+            # expressions nested too deep for the Python parser are interpreted
+            self.program = lambda values: self.calculate({None: values}, False)
+        return self.program
+
+    def bind(self, columns):
+        """Return rpn_tokens compiled into a Python function of a row number, reading variables directly from
+        columns (name -> sequence of values indexed by row). Variables missing from columns are undefined."""
+        namespace = self.namespace()
+        slots = dict()
+
+        def variable(name):
+            if name not in columns:
+                return repr(UNDEFINED_VALUE)
+            if name not in slots:
+                slots[name] = 'v%d' % len(slots)
+                namespace[slots[name]] = columns[name]
+            return '%s[row]' % slots[name]
+        try:
+            return eval('lambda row: ' + self.generate(variable), namespace)
+        except (SyntaxError, MemoryError, RuntimeError):
+            return lambda row: self.calculate({None: dict((name, column[row]) for name, column in columns.iteritems())},
+                                              False)
+
+
+#
+#  Shared sub-expressions
+#
+class SharedColumn(object):
+    """Values of a sub-expression computed on demand and cached for the last `size` rows."""
+
+    def __init__(self, function, size):
+        self.function = function
+        self.size = size
+        self.rows = array.array('l', [-1]) * size  # slot -> row the cached value belongs to
+        self.values = [None] * size
+
+    def __getitem__(self, row):
+        slot = row % self.size
+        if self.rows[slot] != row:
+            self.values[slot] = self.function(row)
+            self.rows[slot] = row
+        return self.values[slot]
+
+
+class Dag(object):
+    """Directed acyclic graph of expressions of all assertions checked against the same summaries.
+
+    Nodes are tuples: ('num', value), ('var', slot) where slot is (pport, stat_name, modifier) of a counter,
+    and (operator, node, node). Identical sub-expressions over the same counters are the same node, so a
+    node used more than once is evaluated once per column, or once per row while summaries are streamed,
+    however many assertions and ports refer to it. Rate columns and shared nodes are only computed at the
+    rows the assertions referring to them are checked at, e.g. the time span of SPAN rules."""
+
+    def __init__(self, column, size, complete=True):
+        self.column = column      # function of a slot and its ranges of rows returning the counter by row
+        self.size = size          # number of rows, or of the last rows if summaries are not complete yet
+        self.complete = complete  # shared nodes are computed for all rows at once if all of them are known
+        self.uses = collections.Counter()  # node -> number of times it occurs in added expressions
+        self.operators = dict()            # node -> number of operators in the node
+        self.names = dict()                # slot or shared node -> name in namespace
+        self.inline = set()                # shared nodes which can't be computed for all rows
+        self.rows = dict()                 # node -> ranges of rows it is read at, see add()
+        self.namespace = Calculator.namespace()
+
+    def add(self, calc, binding, rows=None):
+        """Add the expression of the calculator with variables bound to counters by binding (name -> slot),
+        return its node. The expression is read at the list of (start, stop) ranges of rows, all rows if None."""
+        if rows is None:
+            rows = [(0, self.size)]
+        stack = []
+        for token in calc.rpn_tokens:
+            if token.name == 'var':
+                slot = binding.get(token.value)
+                node = ('var', slot) if slot else ('num', UNDEFINED_VALUE)
+            elif token.name == 'num':
+                node = ('num', float(token.value))
+            else:
+                b = stack.pop()
+                a = stack.pop()
+                node = (token.name, a, b)
+                if node not in self.operators:
+                    self.operators[node] = self.operators.get(a, 0) + self.operators.get(b, 0) + 1
+                self.uses[node] += 1
+            if node[0] != 'num':
+                self.rows[node] = merge_ranges(self.rows.get(node, []) + rows)
+            stack.append(node)
+        return stack[-1]
+
+    def ranges(self, node):
+        """Return a sorted list of disjoint (start, stop) ranges of rows the node is read at."""
+        return self.rows.get(node) or [(0, self.size)]
+
+    def extent(self, node, start, stop):
+        """Return the range of rows the node is read at containing rows start..stop-1, (start, stop) if none."""
+        for first, last in self.ranges(node):
+            if first <= start and stop <= last:
+                return first, last
+        return start, stop
+
+    def shared(self, node):
+        """Return True if values of the node are cached."""
+        return self.uses[node] > 1 and self.operators[node] >= SHARED_MIN_OPERATORS and node not in self.inline
+
+    def source(self, node, top=False):
+        """Return Python source of the node reading counters and shared nodes by row."""
+        if node[0] == 'num':
+            return repr(node[1])
+        if node[0] == 'var':
+            return self.counter(node[1])[0] + '[row]'
+        if not top and self.shared(node) and self.shared_column(node):
+            return self.shared_column(node)[0] + '[row]'
+        return operator_source(node[0], self.source(node[1]), self.source(node[2]))
+
+    def counter(self, slot):
+        """Return (name, column) of the counter, the column is made once for all of its uses."""
+        name = self.names.get(slot)
+        if name is None:
+            name = self.names[slot] = 'c%d' % len(self.names)
+            self.namespace[name] = self.column(slot, self.ranges(('var', slot)))
+        return name, self.namespace[name]
+
+    def shared_column(self, node):
+        """Return (name, column) of the shared node, or None if it has to be evaluated inline."""
+        if node in self.inline:
+            return None
+        name = self.names.get(node)
+        if name is None:
+            function = eval('lambda row: ' + self.source(node, True), self.namespace)
+            if self.complete:
+                # rows no assertion reads are left 0.0
+                column = array.array('d', [0.0]) * self.size
+                try:
+                    for start, stop in self.ranges(node):
+                        column[start:stop] = array.array('d', map(function, xrange(start, stop)))
+                except CalculationError:
+                    # the error is raised when the row is evaluated by the assertion itself
+                    self.inline.add(node)
+                    return None
+            else:
+                column = SharedColumn(function, self.size)
+            name = self.names[node] = 's%d' % len(self.names)
+            self.namespace[name] = column
+        return name, self.namespace[name]
+
+    def program(self, node):
+        """Return the node compiled into a Python function of a row number, or None if it can't be compiled."""
+        try:
+            if node[0] not in ('num', 'var') and self.shared(node) and self.shared_column(node):
+                return self.shared_column(node)[1].__getitem__
+            return eval('lambda row: ' + self.source(node, True), self.namespace)
+        except (SyntaxError, MemoryError, RuntimeError):
+            return None
+
+    def shared_count(self):
+        """Return the number of shared nodes compiled so far."""
+        return sum(1 for name in self.namespace if name[0] == 's' and name[1:].isdigit())
@@ -1,15 +1,18 @@
 import argparse
 import collections
+import cPickle as pickle
 import logging
 import os
 import re
 import sys
 import json
+import tempfile
 
 #
 # Constants
 #
 SWIFTTEST_PROJECT_FILE_EXT = ".swift_test"
+CACHE_DIR = os.path.expanduser('~/.tac/cache')
 
 #
 # Common utils
@@ -23,6 +26,85 @@ def get_files(directory, pattern):
     return [os.path.join(directory, f) for f in os.listdir(directory) if re.match(pattern, f) and not f.startswith('.')]
 
 
+def load_cache(path):
+    """Return the object pickled into the cache file at path, or None if it is missing or unreadable."""
+    try:
+        with open(path, 'rb') as cache_file:
+            return pickle.load(cache_file)
+    except Exception:
+        return None
+
+
+def save_cache(path, obj):
+    """Pickle obj into the cache file at path, see write_cache(); failures are not fatal."""
+    return write_cache(path, lambda cache_file: pickle.dump(obj, cache_file, pickle.HIGHEST_PROTOCOL))
+
+
+def load_json_cache(path):
+    """Return the object stored as JSON in the cache file at path with strings as str, or None if it is missing
+    or can't be parsed. Caches in results and project directories, which may be on shared volumes, are JSON
+    rather than pickles, since unpickling a file can run any code."""
+    try:
+        with open(path, 'rb') as cache_file:
+            return encode_strings(json.load(cache_file))
+    except Exception:
+        return None
+
+
+def save_json_cache(path, obj):
+    """Store obj, made of dicts with string keys, lists, strings and numbers, as JSON into the cache file at
+    path, see write_cache(); failures are not fatal."""
+    return write_cache(path, lambda cache_file: json.dump(obj, cache_file))
+
+
+def encode_strings(obj):
+    """Return the object loaded from JSON with unicode strings encoded as UTF-8 str."""
+    if isinstance(obj, unicode):
+        return obj.encode('utf-8')
+    if isinstance(obj, list):
+        return [encode_strings(item) for item in obj]
+    if isinstance(obj, dict):
+        return dict((encode_strings(key), encode_strings(value)) for key, value in obj.iteritems())
+    return obj
+
+
+def write_cache(path, write):
+    """Write a cache file at path with write(file) and return False on failure. The file is written under a
+    unique temporary name and renamed, so processes and threads writing the same cache don't mix their files and
+    readers see either the old or the new file (on POSIX; Windows can't rename over a file, which is removed
+    first there)."""
+    tmp_path = None
+    try:
+        cache_dir = os.path.dirname(path)
+        if not os.path.exists(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                # created by another writer meanwhile
+                if not os.path.isdir(cache_dir):
+                    raise
+        handle, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=cache_dir)
+        with os.fdopen(handle, 'wb') as cache_file:
+            write(cache_file)
+        # mkstemp creates files readable by the owner only, caches in shared directories are read by others
+        os.chmod(tmp_path, 0644)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            if not sys.platform.startswith('win') or not os.path.exists(path):
+                raise
+            os.remove(path)
+            os.rename(tmp_path, path)
+        return True
+    except Exception:
+        if tmp_path and os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        return False
+
+
 def is_project(path):
     for s in os.listdir(path):
         subitem = os.path.join(path, s)
@@ -33,6 +115,16 @@ def is_project(path):
     return False
 
 
+def check_engine(parser, engine):
+    """Exit with an error of the argument parser if the assertion evaluation engine can't be used here, rather
+    than failing every project once it has run."""
+    if engine == 'numpy':
+        try:
+            import numpy
+        except ImportError:
+            parser.error('argument -e/--engine: numpy requires NumPy, which is not installed')
+
+
 def dig_tests(path, depth=256):
     """Look through the directory tree starting from 'path' to the given 'depth' and return a list of
     full paths to test projects found. [depth == 1: no search in subfolders; default: search to the depth of 256]"""
@@ -62,6 +154,14 @@ class Arguments(object):
     test_list = ""
     tests_by_type = dict()
     simulate = False
+    no_cache = False
+    engine = 'compiled'
+    streaming = False
+    jobs = 1
+    concurrent = 1
+    converters = 2
+    schedule = 'list'
+    dry_run = False
     depth = 256
     parser = argparse.ArgumentParser()
 
@@ -71,7 +171,8 @@ class Arguments(object):
         self.parser.add_argument('-v', '--verbose', help='verbose mode', action='store_true')
         self.parser.add_argument('-s', '--stop_ports', help='stop ports before run', action='store_true')
         self.parser.add_argument('-f', '--find_cfg',
-                            help='find AutomationConfig first, use convertion only if there is no config',
+                            help='find AutomationConfig first, use convertion only if there is no config '
+                                 'or the project files have changed since it was converted',
                             action='store_true')
         self.parser.add_argument('-l', '--log_file', help='custom path to log file')
         self.parser.add_argument('-t', '--test_list',
@@ -79,6 +180,27 @@ class Arguments(object):
                             type=argparse.FileType('r'))
         self.parser.add_argument('-m', '--simulate',
                             help='simulation mode (without connection to device)', action='store_true')
+        self.parser.add_argument('-n', '--no_cache',
+                            help='do not use persistent caches in ' + CACHE_DIR, action='store_true')
+        self.parser.add_argument('-e', '--engine',
+                            help='assertion evaluation engine: compiled (default), interpreter or numpy (vectorized)',
+                            choices=['compiled', 'interpreter', 'numpy'], default='compiled')
+        self.parser.add_argument('-S', '--streaming',
+                            help='check assertions while summaries are decoded, without keeping them in memory',
+                            action='store_true')
+        self.parser.add_argument('-j', '--jobs',
+                            help='number of processes checking assertions of a project (default: 1)', type=int, default=1)
+        self.parser.add_argument('-c', '--concurrent',
+                            help='number of projects using disjoint physical ports run at the same time (default: 1)',
+                            type=int, default=1)
+        self.parser.add_argument('-C', '--converters',
+                            help='number of projects converted by LdxCmd at the same time (default: 2)', type=int, default=2)
+        self.parser.add_argument('-L', '--schedule',
+                            help='order of concurrent projects: list (default) or lpt (longest first, shortest total duration)',
+                            choices=['list', 'lpt'], default='list')
+        self.parser.add_argument('-D', '--dry_run',
+                            help='print the schedule of projects with the predicted finish time and exit, without converting them',
+                            action='store_true')
         self.parser.add_argument('-d', '--depth', help='depth of search for test projects in folders', type=int, default=256)
         self.parser.add_argument('-T', '--test_types',
                             help='types of tests',
@@ -90,6 +212,10 @@ class Arguments(object):
             sys.exit(1)
         else:
             args = self.parser.parse_args()
+        check_engine(self.parser, args.engine)
+        if args.schedule == 'lpt' and args.concurrent <= 1:
+            # projects run one at a time always run in the order of the list
+            self.parser.error('argument -L/--schedule: lpt requires -c/--concurrent greater than 1')
 
         self.args = args
         self.parse_test_list()
@@ -102,6 +228,14 @@ class Arguments(object):
         self.test_list = args.test_list
         self.verbose = bool(args.verbose)
         self.simulate = bool(args.simulate)
+        self.no_cache = bool(args.no_cache)
+        self.engine = args.engine
+        self.streaming = bool(args.streaming)
+        self.jobs = max(1, args.jobs)
+        self.concurrent = max(1, args.concurrent)
+        self.converters = max(1, args.converters)
+        self.schedule = args.schedule
+        self.dry_run = bool(args.dry_run)
 
     # def expand_folders(self):
     #     """Append test folders from 'folders' parameter or from file given as 'test_list' parameter"""
@@ -214,3 +348,23 @@ class Logger(object):
         if self.verbose_mode:
             print 'WARNING:', Bcolors.WARNING + msg + Bcolors.ENDC
         logging.warning(msg)
+
+
+class RecordingLog(object):
+    """Logger keeping (level, message) records for another logger to log later, e.g. the log of assertions
+    checked in a pool process or of a project running in a thread."""
+
+    def __init__(self):
+        self.records = []
+
+    def info(self, msg):
+        self.records.append(('info', msg))
+
+    def verbose(self, msg):
+        self.records.append(('verbose', msg))
+
+    def error(self, msg):
+        self.records.append(('error', msg))
+
+    def warning(self, msg):
+        self.records.append(('warning', msg))
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+import argparse
+import random
+import sys
+
+import tac_assertions
+import tac_common
+import tac_project
+import tac_vectorized
+
+#
+# Differential fuzzing of the ways assertions are checked, run from the repository root:
+#   python tac_fuzz.py [-n CASES] [-r RULES] [-s SEED] [-e ENGINES]
+# Random assertion files are checked against generated samples of a synthetic project by every engine, and any
+# difference of verdicts, failure messages or errors is printed. Neither summary files nor appliances are used.
+#
+ENGINES = {
+    'compiled': {},
+    'interpreter': {'engine': 'interpreter'},
+    'numpy': {'engine': 'numpy'},
+    'streaming': {'streaming': True},
+    'parallel': {'jobs': 3},
+    'parallel_numpy': {'engine': 'numpy', 'jobs': 3},
+}
+ASSERTIONS_FILE = 'fuzz.assertions'
+PORTS = [(tac_common.LogicalPort(1, 'client'), tac_common.PhysicalPort(0, '10.0.0.1')),
+         (tac_common.LogicalPort(1, 'server'), tac_common.PhysicalPort(1, '10.0.0.1')),
+         (tac_common.LogicalPort(2, 'client'), tac_common.PhysicalPort(2, '10.0.0.1'))]
+VARIABLES = ['a', 'b', 'load.actions.fails', 'cport.a', 'sport.b', 'cport1.a', 'sport1.b', 'cport2.b', 'sport2.a']
+MODIFIERS = ['', '', '', '@sec', '@min']
+NUMBERS = ['0', '1', '2', '3.5', '100']
+OPERATORS = ['*', '/', '%', '+', '-', '<', '<=', '>', '>=', '==', '!=', '&', '|']
+RULES = ['ANY', 'LAST', 'ANY_EXCEPT_LAST', 'SPAN[0:3]', 'SPAN[2:5]', 'SPAN[10:40]']
+
+
+class FuzzArguments(object):
+    """Parameters of the synthetic project: nothing is cached, the engine is set per check."""
+    simulate = True
+    no_cache = True
+    engine = 'compiled'
+    streaming = False
+    jobs = 1
+
+    def __init__(self, options):
+        self.__dict__.update(options)
+
+
+class Port(object):
+    """Port of the synthetic project as swifttest.Project iterates them."""
+
+    def __init__(self, pport):
+        self.pport = pport
+
+    def getportnum(self):
+        return self.pport.number
+
+    def getappliance(self):
+        return self.pport.appliance_ip
+
+
+class Ports(object):
+    """Stand-in for swifttest.Project of the synthetic project."""
+
+    def __init__(self, pports):
+        self.ports = [Port(pport) for pport in pports]
+
+    def name(self):
+        return 'fuzz'
+
+    def __iter__(self):
+        return iter(self.ports)
+
+
+class Project(object):
+    """Synthetic project with the logical ports of PORTS mapped to its physical ports."""
+
+    def __init__(self, params):
+        self.params = params
+        self.project_dir = ''
+        self.results_dir = ''
+        self.project = Ports(pport for lport, pport in PORTS)
+        self.mapping = tac_project.PortMapping(None)
+        for lport, pport in PORTS:
+            self.mapping.l2p[lport] = pport
+            self.mapping.p2l[pport] = lport
+
+
+class FuzzAssertions(tac_assertions.Assertions):
+    """Assertions of the content of an assertion file checked against samples: pport -> list of counters."""
+
+    def __init__(self, project, log, content, samples):
+        self.content = content
+        self.samples = samples
+        tac_assertions.Assertions.__init__(self, project, log)
+
+    def load_assertions(self):
+        interpreted = self.project.params.engine == 'interpreter'
+        self.assertions = [a.copy(self.log, interpreted)
+                           for a in tac_assertions.Ruleset.parse(ASSERTIONS_FILE, self.content)]
+
+    def plan(self):
+        # every counter of the samples is valid, so the swifttest API is not asked
+        self.make_plans()
+        self.counters = self.used_counters()
+        return bool(self.counters)
+
+    def open_summaries(self):
+        return dict((pport, (dict((stat_name, value) for stat_name, value in counters.iteritems()
+                                  if stat_name in self.counters) for counters in samples))
+                    for pport, samples in self.samples.iteritems())
+
+
+def make_samples(rng, ticks, fail_at):
+    """Return samples of cumulative counters of the ports, which end at different ticks."""
+    samples = dict()
+    for i, (lport, pport) in enumerate(PORTS):
+        counters = {'a': 0, 'b': 0, 'load.actions.succeeds': 0, 'load.actions.fails': 0}
+        samples[pport] = []
+        for tick in xrange(ticks - 3 * i):
+            counters = dict(counters)
+            counters['a'] += 1
+            counters['b'] += 2
+            counters['load.actions.succeeds'] += rng.randint(0, 5)
+            if fail_at is not None and tick >= fail_at and lport.number == 2:
+                counters['load.actions.fails'] = 1
+            samples[pport].append(counters)
+    return samples
+
+
+def make_term(rng, depth):
+    """Return a random expression of at most the given depth of operators."""
+    r = rng.random()
+    if depth <= 0 or r < 0.35:
+        if rng.random() < 0.3:
+            return rng.choice(NUMBERS)
+        return rng.choice(VARIABLES) + rng.choice(MODIFIERS)
+    if r < 0.45:
+        return '( %s )' % make_term(rng, depth - 1)
+    return '%s %s %s' % (make_term(rng, depth - 1), rng.choice(OPERATORS), make_term(rng, depth - 1))
+
+
+def check(engine, content, samples):
+    """Return the outcome of checking the assertion file content with the engine: the verdicts and failure
+    messages of assertions, or the name of the error raised."""
+    log = tac_common.RecordingLog()
+    try:
+        assertions = FuzzAssertions(Project(FuzzArguments(ENGINES[engine])), log, content, samples)
+        if assertions.project.params.streaming:
+            assertions.stream_summaries()
+        else:
+            assertions.load_summaries()
+        assertions.passed()
+    except Exception as e:
+        # any error is an outcome, engines have to agree on it
+        return type(e).__name__
+    messages = [message for level, message in log.records if 'Assertion failed' in message or 'ignored' in message]
+    return [a.active for a in assertions.assertions], messages
+
+
+def fuzz(engines, cases, rules, seed):
+    """Check random cases with the engines, print the ones they disagree on and return their number."""
+    mismatches = 0
+    for case in xrange(cases):
+        rng = random.Random(seed + case)
+        content = ''.join('%s %s\n' % (rng.choice(RULES), make_term(rng, 3)) for i in xrange(rules))
+        samples = make_samples(rng, rng.randint(3, 80), rng.choice([None, 5, 30]))
+        outcomes = [check(engine, content, samples) for engine in engines]
+        if any(outcome != outcomes[0] for outcome in outcomes):
+            mismatches += 1
+            print 'Mismatch in case %d (seed %d):' % (case, seed + case)
+            print content.rstrip('\n')
+            for engine, outcome in zip(engines, outcomes):
+                print '  %-15s %s' % (engine, outcome)
+    print 'Cases: %d, assertions: %d, mismatches: %d' % (cases, cases * rules, mismatches)
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Differential fuzzing of the ways assertions are checked.')
+    parser.add_argument('-n', '--cases', type=int, default=50, help='number of random assertion files')
+    parser.add_argument('-r', '--rules', type=int, default=5, help='number of assertions per file')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='seed of the first case')
+    parser.add_argument('-e', '--engines', help='comma-separated engines to compare: %s (all available by default)'
+                        % ', '.join(sorted(ENGINES)))
+    args = parser.parse_args()
+    if args.engines:
+        engines = args.engines.split(',')
+        unknown = [engine for engine in engines if engine not in ENGINES]
+        if unknown:
+            parser.error('unknown engines: ' + ', '.join(unknown))
+    else:
+        engines = [engine for engine in sorted(ENGINES)
+                   if tac_vectorized.numpy is not None or ENGINES[engine].get('engine') != 'numpy']
+    sys.exit(1 if fuzz(engines, args.cases, args.rules, args.seed) else 0)
+
+
+if __name__ == '__main__':
+    main()
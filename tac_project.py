@@ -1,3 +1,5 @@
+import _strptime  # time.strptime imports it on first use, which fails if projects run in threads
+import hashlib
 import imp
 import os
 import re
@@ -7,6 +9,7 @@ import time
 import xml.etree.ElementTree as ET
 import tempfile
 import datetime
+import heapq
 
 if sys.platform.startswith("win"):
     import _winreg
@@ -15,6 +18,7 @@ import swifttest
 
 import tac_assertions
 import tac_common
+import tac_summary
 
 #
 # Regexps
@@ -29,6 +33,10 @@ WINDOWS_GUID_RX = "\{[0-9A-F]{8}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{12
 #
 
 GLOBAL_PORTS_DIR = '/opt/swifttest/resources/dotnet/Ports/'
+RESULTS_DIR_TIME_FORMAT = '%m_%d_%Y %I-%M-%S %p'  # name of a Results subdirectory, see LdxProject.load()
+AUTOMATION_CONFIG_FILE = os.path.join('AutomationConfig', 'AutomationConfig.xml')  # relative to a project
+CONVERSION_CACHE_FILE = os.path.join('AutomationConfig', '.tac-conversion.cache')  # relative to a project
+CONVERSION_CACHE_VERSION = 2
 WAIT_INTERVAL = 1 # sec
 
 #
@@ -149,22 +157,59 @@ class PortMapping:
         self.log.verbose('Loaded %s' % file)
         return (lport, pport)
 
-    def load_from_automation_config(self, xml_path):
-        """Parse automation config xml_path and update mapping."""
+    def load_from_automation_config(self, config):
+        """Update mapping from ports of the AutomationConfig model."""
         self.p2l.clear()
         self.l2p.clear()
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
-        client_ports = root.findall('./ClientPortConfig')
-        server_ports = root.findall('./ServerPortConfig')
-        for cp in client_ports:
-            cport = Port(self.log, cp)
-            self.p2l[cport.pport] = cport.lport
-            self.l2p[cport.lport] = cport.pport
-        for sp in server_ports:
-            sport = Port(self.log, sp)
-            self.p2l[sport.pport] = sport.lport
-            self.l2p[sport.lport] = sport.pport
+        for xml_element in config.client_ports + config.server_ports:
+            port = Port(self.log, xml_element)
+            self.p2l[port.pport] = port.lport
+            self.l2p[port.lport] = port.pport
+
+
+#
+# AutomationConfig
+#
+class AutomationConfig(object):
+    """Model of an AutomationConfig.xml file read by ElementTree.iterparse in one pass. Only port configurations
+    are kept as elements; every other element is removed from the tree as soon as its end is parsed, so memory
+    use does not depend on the size of scenarios."""
+
+    def __init__(self, xml_path):
+        self.xml_path = xml_path
+        self.mtime = os.path.getmtime(xml_path)
+        self.client_ports = []  # ClientPortConfig elements
+        self.server_ports = []  # ServerPortConfig elements
+        self.duration = 0       # ms, the longest sum of load durations of a client scenario
+        path = []      # tags of the elements being parsed, from the root
+        elements = []  # the elements themselves
+        loads_duration = 0
+        for event, element in ET.iterparse(xml_path, events=('start', 'end')):
+            if event == 'start':
+                path.append(element.tag)
+                elements.append(element)
+                continue
+            if len(path) > 2 and path[1] in ('ClientPortConfig', 'ServerPortConfig'):
+                # contents of port configurations are kept with them
+                path.pop()
+                elements.pop()
+                continue
+            if path[1:] == ['ClientPortConfig']:
+                self.client_ports.append(element)
+            elif path[1:] == ['ServerPortConfig']:
+                self.server_ports.append(element)
+            else:
+                if path[1:] == ['ClientScenarioConfig', 'Loads', 'Load', 'Duration']:
+                    loads_duration += int(element.text)
+                elif path[1:] == ['ClientScenarioConfig', 'Loads']:
+                    self.duration = max(self.duration, loads_duration)
+                    loads_duration = 0
+                element.clear()
+            path.pop()
+            elements.pop()
+            if elements:
+                # the parsed element is the first child its parent still has, siblings parsed ahead follow it
+                elements[-1].remove(element)
 
 
 #
@@ -186,6 +231,151 @@ class ProjectRunError(Exception):
         return str(self.value)
 
 
+def results_dirs(project_dir, with_summaries=False):
+    """Return a list of (time, path) of Results directories of the project sorted by time, only those having
+    summary files if with_summaries is set."""
+    results = []
+    results_path = os.path.join(project_dir, 'Results')
+    if not os.path.isdir(results_path):
+        return results
+    for name in os.listdir(results_path):
+        results_dir = os.path.join(results_path, name)
+        if os.path.isdir(results_dir):
+            try:
+                t = time.mktime(time.strptime(name, RESULTS_DIR_TIME_FORMAT))
+            except ValueError:
+                continue
+            if not with_summaries or tac_common.get_files(results_dir, tac_assertions.SUMMARY_FILE_RX):
+                results.append((t, results_dir))
+    results.sort()
+    return results
+
+
+def conversion_inputs(project_dir):
+    """Return a sorted list of paths of the files of the project LdxCmd converts, relative to the project: all
+    files except results, AutomationConfig, assertion files and hidden files."""
+    inputs = []
+    for root, dirs, files in os.walk(project_dir):
+        relative = os.path.relpath(root, project_dir)
+        if relative == os.curdir:
+            dirs[:] = [d for d in dirs if d not in ('Results', 'AutomationConfig')]
+            relative = ''
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        inputs.extend(os.path.join(relative, f) for f in files
+                      if not f.startswith('.') and not re.match(tac_assertions.ASSERTION_FILE_RX, f))
+    inputs.sort()
+    return inputs
+
+
+def physical_ports(projects):
+    """Return a list of sets of physical ports of the projects, None for a project whose ports can't be read
+    or which is not converted yet."""
+    ports = []
+    for project in projects:
+        if not project.converted():
+            ports.append(None)
+            continue
+        try:
+            ports.append(project.physical_ports())
+        except Exception as e:
+            project.log.warning('Cannot read physical ports of "%s": %s' % (project.project_dir, str(e)))
+            ports.append(None)
+    return ports
+
+
+class Scheduler(object):
+    """Order in which projects run at the same time on disjoint sets of physical ports.
+
+    By default a project starts once every earlier project in the list sharing a physical port with it has
+    finished. With lpt set, the longest of the pending projects whose ports are not in use starts first
+    (longest processing time first), which shortens the total duration of the batch. A project whose ports
+    are unknown (None) shares them with all other projects.
+
+    Only available projects start; the others (e.g. being converted) are made available later."""
+
+    def __init__(self, ports, durations, concurrent, lpt=False, available=None):
+        self.ports = list(ports)
+        self.durations = list(durations)
+        self.concurrent = concurrent
+        self.lpt = lpt
+        count = len(ports)
+        self.conflicts = [self.find_conflicts(i) for i in xrange(count)]
+        self.pending = range(count)
+        self.sort()
+        self.available = set(xrange(count) if available is None else available)
+        self.running = set()
+        self.done = set()
+
+    def find_conflicts(self, i):
+        """Return a set of the other projects sharing a physical port with the project."""
+        ports = self.ports
+        return set(j for j in xrange(len(ports))
+                   if j != i and (ports[i] is None or ports[j] is None or ports[i] & ports[j]))
+
+    def sort(self):
+        """Sort pending projects by duration if the longest are to start first."""
+        if self.lpt:
+            # sorting is stable, so projects of the same duration keep the order of the list
+            self.pending.sort(key=lambda i: -self.durations[i])
+
+    def make_available(self, i, ports, duration):
+        """Let the pending project start, with its physical ports and duration known once it is converted."""
+        self.ports[i] = ports
+        self.durations[i] = duration
+        self.conflicts[i] = self.find_conflicts(i)
+        for j in xrange(len(self.ports)):
+            if j in self.conflicts[i]:
+                self.conflicts[j].add(i)
+            else:
+                self.conflicts[j].discard(i)
+        self.sort()
+        self.available.add(i)
+
+    def skip(self, i):
+        """Consider the pending project finished without running it."""
+        self.pending.remove(i)
+        self.done.add(i)
+
+    def ready(self, i):
+        """Return True if the pending project can start now."""
+        # a project made available may share ports with a later project which has started before
+        if self.conflicts[i] & self.running:
+            return False
+        return self.lpt or all(j in self.done for j in self.conflicts[i] if j < i)
+
+    def start(self):
+        """Return a list of indices of the projects to start now, which are considered running then."""
+        started = []
+        for i in list(self.pending):
+            if len(self.running) >= self.concurrent:
+                break
+            if i in self.available and self.ready(i):
+                self.pending.remove(i)
+                self.running.add(i)
+                started.append(i)
+        return started
+
+    def finish(self, i):
+        """Mark the running project finished."""
+        self.running.remove(i)
+        self.done.add(i)
+
+    def plan(self):
+        """Return a list of predicted (start, finish) times of projects, relative to the start of the batch in
+        the units of durations, simulating the schedule."""
+        schedule = Scheduler(self.ports, self.durations, self.concurrent, self.lpt, self.available)
+        times = [None] * len(self.ports)
+        finishing = []  # heap of (finish time, project index)
+        now = 0
+        while schedule.pending or schedule.running:
+            for i in schedule.start():
+                times[i] = (now, now + self.durations[i])
+                heapq.heappush(finishing, (now + self.durations[i], i))
+            now, i = heapq.heappop(finishing)
+            schedule.finish(i)
+        return times
+
+
 # ===============================================-------------------=============================================== #
 # =============================================== CLASS  LdxProject =============================================== #
 # ===============================================-------------------=============================================== #
@@ -200,15 +390,83 @@ class LdxProject(object):
         self.name = ''
         self.results_dir = ''
         self.mapping = None
-        self.xml_path = os.path.join(self.project_dir, 'AutomationConfig', 'AutomationConfig.xml')
+        self.xml_path = os.path.join(self.project_dir, AUTOMATION_CONFIG_FILE)
         self.LDXCMD_BIN = ""
+        self.ldxcmd_version = ""
+        self.stale = None  # see needs_conversion()
+        self.config = None  # see automation_config()
+
+    def prepare(self):
+        """Convert the project to AutomationConfig if needed and return True if it has been converted. Checking
+        hashes the project files and conversion runs LdxCmd in a subprocess, so tac.py prepares projects in a
+        pool of threads while prepared projects run."""
+        if not self.needs_conversion():
+            self.log.verbose('AutomationConfig is up to date: %s' % self.xml_path)
+            return False
+        # convert the project and find the results directory that has been created during conversion
+        self.convert()
+        self.get_last_results_dir()
+        self.stale = False
+        if not self.params.no_cache:
+            # LdxCmd upgrades project files, so the key is that of the converted project
+            tac_common.save_json_cache(os.path.join(self.project_dir, CONVERSION_CACHE_FILE),
+                                       {'version': CONVERSION_CACHE_VERSION, 'key': self.conversion_key()})
+        return True
 
-        # If AutomationConfig does not exist or if the find_cfg argument is not set -
-        if not self.converted() or not self.params.find_cfg:
-            # then don't convert again, just make a new results folder
-            # otherwise - convert the project and find the results directory that has been created during conversion
-            self.convert()
-            self.get_last_results_dir()
+    def needs_conversion(self):
+        """Return True if the project is to be converted to AutomationConfig (the answer is kept).
+
+        A project is converted if AutomationConfig does not exist or if the conversion cache next to it records
+        different project files, or (unless the find_cfg argument is set) a different LdxCmd. With find_cfg, the
+        files of a project whose AutomationConfig has no conversion cache are recorded as converted."""
+        if self.stale is None:
+            self.stale = self.conversion_stale()
+        return self.stale
+
+    def conversion_stale(self):
+        """Return True if AutomationConfig is missing or out of date, see needs_conversion()."""
+        if not self.converted():
+            return True
+        cached = tac_common.load_json_cache(os.path.join(self.project_dir, CONVERSION_CACHE_FILE))
+        if not isinstance(cached, dict) or cached.get('version') != CONVERSION_CACHE_VERSION:
+            cached = None
+        if self.params.find_cfg:
+            # AutomationConfig converted by other means is used as it is, LdxCmd may even be missing
+            if self.params.no_cache:
+                return False
+            digest = self.inputs_digest()
+            if not cached:
+                # the project files it has been found with are recorded, so that later edits are converted; the
+                # LdxCmd which has converted them is unknown
+                tac_common.save_json_cache(os.path.join(self.project_dir, CONVERSION_CACHE_FILE),
+                                           {'version': CONVERSION_CACHE_VERSION, 'key': [digest, None]})
+                return False
+            return cached['key'][0] != digest
+        if not cached or self.params.no_cache:
+            return True
+        try:
+            return cached['key'] != self.conversion_key()
+        except ProjectFileError:
+            # LdxCmd is not found, the conversion reports it
+            return True
+
+    def inputs_digest(self):
+        """Return SHA-1 of the names and contents of the project files LdxCmd converts."""
+        digest = hashlib.sha1()
+        for name in conversion_inputs(self.project_dir):
+            digest.update(name.replace(os.sep, '/') + '\0')
+            with open(os.path.join(self.project_dir, name), 'rb') as input_file:
+                for chunk in iter(lambda: input_file.read(1 << 20), ''):
+                    digest.update(chunk)
+            digest.update('\0')
+        return digest.hexdigest()
+
+    def conversion_key(self):
+        """Return the key AutomationConfig is valid for: [digest of project files, [LdxCmd version, size and
+        modification time]], as it is stored in the conversion cache."""
+        self.find_ldxcmd()
+        stat = os.stat(self.LDXCMD_BIN)
+        return [self.inputs_digest(), [self.ldxcmd_version, stat.st_size, stat.st_mtime]]
 
     def load(self):
         self.start_time = ("{}_{}_{} {}-{}-{} {}").format(
@@ -237,20 +495,21 @@ class LdxProject(object):
             return False
         return True
 
+    def automation_config(self):
+        """Return the AutomationConfig model of the project, parsed once unless the file is converted again."""
+        if self.config is None or self.config.mtime != os.path.getmtime(self.xml_path):
+            self.config = AutomationConfig(self.xml_path)
+        return self.config
+
+    def physical_ports(self):
+        """Return a set of physical ports the project is mapped to by its AutomationConfig."""
+        mapping = PortMapping(self.log)
+        mapping.load_from_automation_config(self.automation_config())
+        return set(mapping.p2l)
+
     def duration(self):
-        """Parse automation config file and get test duration time."""
-        tree = ET.parse(self.xml_path)
-        root = tree.getroot()
-        load_profiles = root.findall('./ClientScenarioConfig/Loads')
-        test_duration = 0
-        for lp in load_profiles:
-            loads = lp.findall('Load')
-            load_profile_duration = 0
-            for load in loads:
-                load_profile_duration += int(load.find('Duration').text)
-            if load_profile_duration > test_duration:
-                test_duration = load_profile_duration
-        return test_duration
+        """Return test duration time (ms) of the automation config."""
+        return self.automation_config().duration
 
     def find_ldxcmd(self):
         if sys.platform.startswith("win"):
@@ -286,6 +545,7 @@ class LdxProject(object):
             if latest_build > 0:
                 self.log.verbose("The latest LdxCmd version found: " + latest_version)
                 self.LDXCMD_BIN = path_to_latest_build
+                self.ldxcmd_version = latest_version
             else:
                 raise ProjectFileError('LdxCmd.exe not found.')
         else:
@@ -381,7 +641,7 @@ class LdxProject(object):
         try:
             # update port mapping from automation config
             if self.converted:
-                self.mapping.load_from_automation_config(self.xml_path)
+                self.mapping.load_from_automation_config(self.automation_config())
             else:
                 # load port mapping from system-wide port configuration files in GLOBAL_PORTS_DIR
                 self.mapping.load_global()
@@ -440,12 +700,27 @@ class LdxProject(object):
             return False
         return True
 
+    def recheck(self, results_dir):
+        """Check assertions against summaries of an earlier run in results_dir and return True if passed.
+        Neither appliances nor LdxCmd are used, so the project must have been converted already."""
+        if not self.converted():
+            raise ProjectFileError('Project is not converted to AutomationConfig: %s' % self.project_dir)
+        self.results_dir = results_dir
+        self.load_automation_config()
+        self.name = self.project.name
+        self.mapping = PortMapping(self.log)
+        self.mapping.load_from_automation_config(self.automation_config())
+        return self.check_assertions()
+
     def check_assertions(self):
         try:
             assertions = tac_assertions.Assertions(self, self.log)
-            assertions.load_summaries()
+            if self.params.streaming:
+                assertions.stream_summaries()
+            else:
+                assertions.load_summaries()
             passed = assertions.passed()
-        except tac_assertions.AssertionsError as e:
+        except (tac_assertions.AssertionsError, tac_summary.SummaryError) as e:
             self.log.error(str(e))
             return False
         return passed
@@ -535,24 +810,8 @@ class LdxProject(object):
 
     def get_last_results_dir(self):
         """ Find last Results directory for the project."""
-        last_result_dir = ""
-        last_result_time = 0
-        results_path = os.path.join(self.project_dir, 'Results')
-        for name in os.listdir(results_path):
-            if os.path.isdir(os.path.join(results_path, name)):
-                try:
-                    t = time.mktime(time.strptime(name, '%m_%d_%Y %H-%M-%S %p'))
-                    if t > last_result_time:
-                        results_dir = os.path.join(self.project_dir, 'Results', name)
-                        if self.params.simulate:
-                            if tac_common.get_files(results_dir, tac_assertions.SUMMARY_FILE_RX):
-                                last_result_time = t
-                                last_result_dir = results_dir
-                        else:
-                            last_result_time = t
-                            last_result_dir = results_dir
-                except ValueError:
-                    continue
+        results = results_dirs(self.project_dir, self.params.simulate)
+        last_result_dir = results[-1][1] if results else ""
         if last_result_dir:
             self.results_dir = last_result_dir
             return True
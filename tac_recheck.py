@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+import argparse
+import datetime
+import multiprocessing
+import os
+import sys
+import time
+
+import tac_assertions
+import tac_common
+import tac_project
+import tac_summary
+
+#
+# Re-check of assertions against earlier results of converted projects, run from the repository root:
+#   python tac_recheck.py [--since DATE] [--until DATE] [-j JOBS] project folders
+# Neither appliances nor LdxCmd are used.
+#
+DATE_FORMAT = '%Y-%m-%d'
+
+
+class RecheckArguments(object):
+    """Parameters of LdxProject for re-checks: results are never produced, projects are never converted."""
+    verbose = False
+    simulate = True
+    find_cfg = True
+    stop_ports = False
+    no_cache = False
+    engine = 'compiled'
+    streaming = False
+    jobs = 1  # results directories are checked in parallel instead
+
+    def __init__(self, args):
+        self.verbose = bool(args.verbose)
+        self.no_cache = bool(args.no_cache)
+        self.engine = args.engine
+        self.streaming = bool(args.streaming)
+
+
+def parse_date(value):
+    """Return datetime of a --since or --until argument."""
+    try:
+        return datetime.datetime.strptime(value, DATE_FORMAT)
+    except ValueError:
+        raise argparse.ArgumentTypeError("'%s' is not a date like 2019-12-31" % value)
+
+
+def find_results(folders, depth, since, until, log):
+    """Return a list of (project_dir, results_dir) for Results directories with summary files created within
+    since..until (the whole day of until) of the converted projects found in the folders."""
+    first = time.mktime(since.timetuple()) if since else 0
+    last = time.mktime((until + datetime.timedelta(days=1)).timetuple()) if until else float('inf')
+    tasks = []
+    for folder in folders:
+        for project_dir in tac_common.dig_tests(folder, depth):
+            if not os.path.exists(os.path.join(project_dir, tac_project.AUTOMATION_CONFIG_FILE)):
+                log.warning('Project is not converted to AutomationConfig, skipped: %s' % project_dir)
+                continue
+            for t, results_dir in tac_project.results_dirs(project_dir, with_summaries=True):
+                if first <= t < last:
+                    tasks.append((project_dir, results_dir))
+    return tasks
+
+
+worker = dict()  # state of a pool process, see start_worker()
+
+
+def start_worker(params):
+    worker['params'] = params
+
+
+def recheck(task):
+    """Check assertions of the project against the results directory in a pool process and return
+    (True if passed, False if failed or None if not checked, log records)."""
+    project_dir, results_dir = task
+    log = tac_common.RecordingLog()
+    try:
+        project = tac_project.LdxProject(project_dir, worker['params'], log)
+        passed = project.recheck(results_dir)
+    except (tac_project.ProjectFileError, tac_project.ProjectRunError, tac_project.PortMappingError,
+            tac_assertions.AssertionsError, tac_summary.SummaryError) as e:
+        log.error(str(e))
+        passed = None
+    except Exception as e:
+        log.error('Unexpected error while checking "%s": %s' % (results_dir, str(e)))
+        passed = None
+    return passed, log.records
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-check assertions against earlier results of converted projects.')
+    parser.add_argument('folders', nargs='+', help='folders to search for test projects in')
+    parser.add_argument('--since', type=parse_date, help='check results created on this day (YYYY-MM-DD) or later')
+    parser.add_argument('--until', type=parse_date, help='check results created on this day (YYYY-MM-DD) or earlier')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='number of processes checking results directories (default: number of CPUs)')
+    parser.add_argument('-d', '--depth', help='depth of search for test projects in folders', type=int, default=256)
+    parser.add_argument('-v', '--verbose', help='verbose mode', action='store_true')
+    parser.add_argument('-l', '--log_file', help='custom path to log file', default=tac_common.Arguments.log_file)
+    parser.add_argument('-n', '--no_cache', help='do not use persistent caches in ' + tac_common.CACHE_DIR,
+                        action='store_true')
+    parser.add_argument('-e', '--engine', choices=['compiled', 'interpreter', 'numpy'], default='compiled',
+                        help='assertion evaluation engine: compiled (default), interpreter or numpy (vectorized)')
+    parser.add_argument('-S', '--streaming', action='store_true',
+                        help='check assertions while summaries are decoded, without keeping them in memory')
+    args = parser.parse_args()
+    tac_common.check_engine(parser, args.engine)
+    log = tac_common.Logger(args.log_file, args.verbose)
+    params = RecheckArguments(args)
+
+    tasks = find_results(args.folders, args.depth, args.since, args.until, log)
+    if not tasks:
+        log.error('ERROR: No results directories found in arguments paths. Exit.')
+        sys.exit(1)
+    jobs = max(1, min(args.jobs, len(tasks)))
+    log.info('Results directories to check: %d in %d processes' % (len(tasks), jobs))
+    passed = 0
+    failed = 0
+    aborted = 0
+    pool = multiprocessing.Pool(jobs, start_worker, (params,))
+    try:
+        # results are logged in the order of tasks, the same as checking them in turn does
+        for (project_dir, results_dir), (result, records) in zip(tasks, pool.imap(recheck, tasks)):
+            log.separator()
+            log.info('Checking "%s"' % results_dir)
+            for level, message in records:
+                getattr(log, level)(message)
+            if result:
+                log.info('"%s" passed' % results_dir)
+                passed += 1
+            elif result is None:
+                log.info('"%s" aborted' % results_dir)
+                aborted += 1
+            else:
+                log.info('"%s" failed' % results_dir)
+                failed += 1
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    log.info('\tTotal checked:   ' + str(passed + failed + aborted))
+    log.info('\tTotal passed:    ' + tac_common.Bcolors.OK + str(passed) + tac_common.Bcolors.ENDC)
+    log.info('\tTotal aborted:   ' + tac_common.Bcolors.ABORT + str(aborted) + tac_common.Bcolors.ENDC)
+    log.info('\tTotal failed:    ' + tac_common.Bcolors.FAIL + str(failed) + tac_common.Bcolors.ENDC)
+
+    if (failed == 0) and (aborted == 0):
+        sys.exit(0)
+    else:
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+import array
+import ctypes
+import mmap
+import operator
+import os
+
+
+#
+#  Summary store
+#
+class SummaryError(Exception):
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return str(self.value)
+
+
+def zeros(length):
+    """Return an array('d') of the given length filled with 0.0."""
+    return array.array('d', [0.0]) * length
+
+
+class WindowColumn(object):
+    """Read-only view of a counter column giving its rate over the window of the last `window` rows: the
+    first rows are extrapolated, the others take the difference with the row `window` rows earlier."""
+
+    def __init__(self, column, window):
+        self.column = column
+        self.window = window
+
+    def __getitem__(self, row):
+        value = self.column[row]
+        window = self.window
+        if row < window:
+            return value / (row + 1) * window
+        # counters are zero before the first tick, the [0] item holds the last sample instead
+        if row > window:
+            return value - self.column[row - window]
+        return value
+
+
+def rate(column, window, ranges=None):
+    """Return an array of the values WindowColumn(column, window) gives for every row. Counters are cumulative,
+    so the value over any window is a difference of two rows and is computed once for the whole column, or
+    only for the rows of the list of (start, stop) ranges if it is given; other rows are 0.0 then."""
+    if ranges is None:
+        ranges = [(0, len(column))]
+    values = zeros(len(column))
+    for start, stop in ranges:
+        stop = min(stop, len(column))
+        for row in xrange(start, min(window, stop)):
+            values[row] = column[row] / (row + 1) * window
+        if start <= window < stop:
+            values[window] = column[window]
+        start = max(start, window + 1)
+        if start < stop:
+            values[start:stop] = array.array('d', map(operator.sub, column[start:stop],
+                                                      column[start - window:stop - window]))
+    return values
+
+
+class SummaryStore(object):
+    """Columnar store of summary samples with one array('d') column per (physical port, counter).
+
+    Row 0 holds the last sample of every port, rows 1..N hold the samples of ticks 1..N. A port that has
+    finished earlier than the others reads as 0.0 for the rest of the ticks."""
+
+    complete = True  # all rows are stored
+
+    def __init__(self):
+        self.ports = dict()      # pport -> {stat_name: array('d')}
+        self.last_rows = dict()  # pport -> the last row having a sample of the port
+        self.rows = 1
+        self.empty = zeros(0)
+
+    def __len__(self):
+        return self.rows
+
+    def capacity(self):
+        """Return the number of rows which can be read."""
+        return self.rows
+
+    def load(self, generators):
+        """Append samples from a map (physical_port -> generator of counter dicts) until all of them end."""
+        running = dict(generators)
+        for pport in running:
+            self.ports.setdefault(pport, dict())
+        while running:
+            for pport, generator in running.items():
+                try:
+                    self.add(pport, next(generator))
+                except StopIteration:
+                    del running[pport]
+            if running:
+                self.rows += 1
+        self.close()
+
+    def add(self, pport, counters):
+        """Add counter values of the physical port for the current row."""
+        row = self.rows
+        columns = self.ports[pport]
+        for stat_name, value in counters.iteritems():
+            column = columns.get(stat_name)
+            if column is None:
+                column = columns[stat_name] = zeros(row)
+            column.append(value or 0.0)
+        # counters missing from this sample read as 0.0
+        if len(counters) != len(columns):
+            for column in columns.itervalues():
+                if len(column) == row:
+                    column.append(0.0)
+        self.last_rows[pport] = row
+
+    def close(self):
+        """Put the last sample of each port into row 0 and pad finished ports up to the number of rows."""
+        for pport, columns in self.ports.iteritems():
+            last_row = self.last_rows.get(pport)
+            for column in columns.itervalues():
+                if last_row:
+                    column[0] = column[last_row]
+                if len(column) < self.rows:
+                    column.extend(zeros(self.rows - len(column)))
+        self.empty = zeros(self.rows)
+
+    def export(self, path):
+        """Write all columns into the file at path one after another and return the layout of the file:
+        pport -> {stat_name: offset of the column in values}."""
+        layout = dict()
+        offset = 0
+        with open(path, 'wb') as columns_file:
+            for pport, columns in self.ports.iteritems():
+                layout[pport] = dict()
+                for stat_name, column in columns.iteritems():
+                    column.tofile(columns_file)
+                    layout[pport][stat_name] = offset
+                    offset += len(column)
+        return layout
+
+    def port(self, pport, stat_name):
+        try:
+            return self.ports[pport]
+        except KeyError:
+            raise SummaryError("Value '{0}' not found for {1}. Check port configuration.".format(stat_name, pport))
+
+    def column(self, pport, stat_name):
+        """Return the whole column of the counter on the physical port."""
+        return self.port(pport, stat_name).get(stat_name, self.empty)
+
+
+class MappedStore(SummaryStore):
+    """Read-only SummaryStore with columns mapped from a file written by SummaryStore.export, so that processes
+    share them without copying."""
+
+    def __init__(self, path, layout, rows):
+        SummaryStore.__init__(self)
+        self.path = path
+        self.layout = layout
+        self.rows = rows
+        self.empty = zeros(rows)
+        self.map = None
+        if os.path.getsize(path):
+            with open(path, 'rb') as columns_file:
+                # a private mapping is writable, which ctypes requires, but nothing is ever written
+                self.map = mmap.mmap(columns_file.fileno(), 0, access=mmap.ACCESS_COPY)
+        for pport, offsets in layout.iteritems():
+            self.ports[pport] = dict((stat_name, (ctypes.c_double * rows).from_buffer(self.map, offset * 8))
+                                     for stat_name, offset in offsets.iteritems())
+
+
+class RollingStore(object):
+    """Summary store keeping only the last `history` rows and the last sample of every port, for checking
+    assertions while summaries are decoded. Rows are numbered as in SummaryStore."""
+
+    complete = False  # only the last rows are stored
+
+    def __init__(self, history):
+        self.history = history
+        self.samples = [None] * history  # ring buffer: row % history -> {pport: counters}
+        self.last = dict()               # pport -> the last sample of the port
+        self.rows = 1
+
+    def __len__(self):
+        return self.rows
+
+    def capacity(self):
+        """Return the number of the last rows which can be read."""
+        return self.history
+
+    def stream(self, generators):
+        """Append samples from a map (physical_port -> generator of counter dicts) and yield the number of
+        each row once it is complete. Row 0 is filled when all generators have ended."""
+        running = dict(generators)
+        for pport in running:
+            self.last.setdefault(pport, dict())
+        while running:
+            sample = dict()
+            for pport, generator in running.items():
+                try:
+                    sample[pport] = next(generator)
+                except StopIteration:
+                    del running[pport]
+            if running:
+                self.samples[self.rows % self.history] = sample
+                self.last.update(sample)
+                yield self.rows
+                self.rows += 1
+
+    def value(self, row, pport, stat_name):
+        """Return the value of the counter on the physical port at the row, which must be one of the last
+        `history` rows or row 0."""
+        if pport not in self.last:
+            raise SummaryError("Value '{0}' not found for {1}. Check port configuration.".format(stat_name, pport))
+        if row == 0:
+            counters = self.last[pport]
+        else:
+            if not self.rows - self.history < row <= self.rows:
+                raise SummaryError('Row %d is out of the history of the last %d rows' % (row, self.history))
+            # a port that has finished earlier than the others reads as 0.0
+            counters = self.samples[row % self.history].get(pport, {})
+        return float(counters.get(stat_name) or 0.0)
+
+    def column(self, pport, stat_name):
+        """Return a view of the counter on the physical port indexed by row like a SummaryStore column.
+        Ports are known once streaming has started, so an unknown port is only reported when it is read."""
+        return RollingColumn(self, pport, stat_name)
+
+
+class RollingColumn(object):
+    """Column of a counter on a physical port of RollingStore."""
+
+    def __init__(self, store, pport, stat_name):
+        self.store = store
+        self.pport = pport
+        self.stat_name = stat_name
+
+    def __getitem__(self, row):
+        return self.store.value(row, self.pport, self.stat_name)
@@ -0,0 +1,185 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import tac_calculation
+
+#
+#  Vectorized evaluation of assertions
+#
+class Evaluator(object):
+    """Evaluate assertion expression DAG nodes once over whole per-counter time series using NumPy
+    element-wise operations instead of interpreting them tick by tick. Verdicts are the same as Calculator.calculate gives."""
+
+    def __init__(self, summaries, dag):
+        if numpy is None:
+            raise tac_calculation.CalculationError('NumPy is required for the vectorized evaluation engine.')
+        self.summaries = summaries
+        self.dag = dag
+        self.nodes = dict()  # shared DAG node -> (start, stop, values, error mask) for ticks start..stop-1
+        self.matrices = dict()  # tuple of DAG nodes of ports -> (start, stop, values, error mask), see evaluate_ports()
+
+    def column(self, slot):
+        """Return values of the counter of the slot (pport, stat_name, modifier) for every tick of summaries."""
+        # a view of the counter column of the DAG, rate windows are computed there once, no copy is made
+        return numpy.frombuffer(self.dag.counter(slot)[1], dtype=numpy.float64)
+
+    @staticmethod
+    def binary_op(op, a, b):
+        """Return (result, error mask) of the operator applied to arrays or scalars a and b."""
+        error = False
+        if op == '*':
+            result = a * b
+        elif op == '/':
+            error = b == 0.0
+            result = a / b
+        elif op == '%':
+            error = b == 0.0
+            result = numpy.mod(a, b)
+        elif op == '+':
+            result = a + b
+        elif op == '-':
+            result = a - b
+        elif op == '<':
+            result = a < b
+        elif op == '<=':
+            result = a <= b
+        elif op == '>':
+            result = a > b
+        elif op == '>=':
+            result = a >= b
+        elif op == '==':
+            result = a == b
+        elif op == '!=':
+            result = a != b
+        elif op == '&':
+            result = numpy.where(a != 0.0, b, a)
+        elif op == '|':
+            result = numpy.where(a != 0.0, a, b)
+        else:
+            raise tac_calculation.CalculationError('Bad operator: %s' % op)
+        return numpy.asarray(result, dtype=numpy.float64), error
+
+    @classmethod
+    def apply(cls, op, a, a_error, b, b_error):
+        """Return (result, error mask) of the operator applied to operands with their error masks."""
+        result, error = cls.binary_op(op, a, b)
+        if op in tac_calculation.SHORT_CIRCUIT:
+            # the right operand is not evaluated where the left one decides the result
+            evaluated = (a != 0.0) != tac_calculation.SHORT_CIRCUIT[op]
+            return result, a_error | (evaluated & b_error)
+        return result, a_error | b_error | error
+
+    def evaluate(self, node, start, stop):
+        """Return (values, error mask) of the DAG node for ticks start..stop-1 of summaries. Values of nodes
+        the DAG shares between assertions are computed once."""
+        if node[0] == 'num':
+            return numpy.float64(node[1]), False
+        if node[0] == 'var':
+            return self.column(node[1])[start:stop], False
+        cached = self.nodes.get(node)
+        if cached is not None and cached[0] <= start and stop <= cached[1]:
+            return cached[2][start - cached[0]:stop - cached[0]], cached[3][start - cached[0]:stop - cached[0]]
+        if not self.dag.shared(node):
+            a, a_error = self.evaluate(node[1], start, stop)
+            b, b_error = self.evaluate(node[2], start, stop)
+            return self.apply(node[0], a, a_error, b, b_error)
+        # a shared node is computed once for the range of rows its assertions read around these ticks
+        first, last = self.dag.extent(node, start, stop)
+        a, a_error = self.evaluate(node[1], first, last)
+        b, b_error = self.evaluate(node[2], first, last)
+        result, error = self.apply(node[0], a, a_error, b, b_error)
+        shape = (last - first,)
+        result, error = numpy.broadcast_to(result, shape), numpy.broadcast_to(error, shape)
+        self.nodes[node] = (first, last, result, error)
+        return result[start - first:stop - first], error[start - first:stop - first]
+
+    def evaluate_ports(self, nodes, start, stop):
+        """Return (values, error mask) of the DAG nodes of an expression bound for several ports as matrices
+        of ports x ticks start..stop-1. The nodes have the same operators, as they only differ in counters,
+        so each operator is applied once to the rows of all ports."""
+        cached = self.matrices.get(nodes)
+        if cached is not None and cached[0] <= start and stop <= cached[1]:
+            return cached[2][:, start - cached[0]:stop - cached[0]], cached[3][:, start - cached[0]:stop - cached[0]]
+        if nodes[0][0] == 'num' and len(set(nodes)) == 1:
+            return numpy.float64(nodes[0][1]), False
+        # counters, or variables undefined (-1.0) for some of the ports
+        rows = len(set(node[0] for node in nodes)) > 1 or nodes[0][0] in ('var', 'num')
+        keep = rows or all(self.dag.shared(node) for node in nodes)
+        first, last = start, stop
+        if keep:
+            # the matrix is cached for the range of rows all of the nodes are read at around these ticks
+            extents = [self.dag.extent(node, start, stop) for node in nodes]
+            first, last = max(extent[0] for extent in extents), min(extent[1] for extent in extents)
+        shape = (len(nodes), last - first)
+        if rows:
+            result = numpy.empty(shape)
+            error = numpy.zeros(shape, dtype=bool)
+            for i, node in enumerate(nodes):
+                result[i], error[i] = self.evaluate(node, first, last)
+        else:
+            a, a_error = self.evaluate_ports(tuple(node[1] for node in nodes), first, last)
+            b, b_error = self.evaluate_ports(tuple(node[2] for node in nodes), first, last)
+            result, error = self.apply(nodes[0][0], a, a_error, b, b_error)
+            result, error = numpy.broadcast_to(result, shape), numpy.broadcast_to(error, shape)
+        if keep:
+            self.matrices[nodes] = (first, last, result, error)
+        return result[:, start - first:stop - first], error[:, start - first:stop - first]
+
+    def verdicts(self, assertion, start, stop):
+        """Return (verdicts, error mask) of the assertion for ticks start..stop-1 of summaries.
+
+        Ports are checked in the order of the bound nodes of the assertion and the first port the expression
+        is false for decides the verdict of a tick, exactly as Calculator.calculate does."""
+        if len(assertion.nodes) > 1:
+            return self.port_verdicts(assertion, start, stop)
+        shape = (stop - start,)
+        verdicts = numpy.zeros(shape, dtype=bool)
+        errors = numpy.zeros(shape, dtype=bool)
+        decided = numpy.zeros(shape, dtype=bool)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            for lport, node in assertion.nodes:
+                result, error = self.evaluate(node, start, stop)
+                result = numpy.broadcast_to(result, shape)
+                undecided = ~decided
+                errors |= error & undecided
+                verdicts = numpy.where(undecided, numpy.trunc(result) != 0.0, verdicts)
+                decided |= result == 0.0
+        return verdicts, errors
+
+    def port_verdicts(self, assertion, start, stop):
+        """Return (verdicts, error mask) of the assertion bound for several ports for ticks start..stop-1,
+        evaluating all ports at once."""
+        ports = len(assertion.nodes)
+        shape = (ports, stop - start)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            result, error = self.evaluate_ports(tuple(node for lport, node in assertion.nodes), start, stop)
+        result = numpy.broadcast_to(result, shape)
+        error = numpy.broadcast_to(error, shape)
+        false = result == 0.0
+        # the first port the expression is false for decides the verdict, the last one if there is none
+        deciding = numpy.where(false.any(axis=0), numpy.argmax(false, axis=0), ports - 1)
+        verdicts = numpy.trunc(result[deciding, numpy.arange(stop - start)]) != 0.0
+        errors = (error & (numpy.arange(ports)[:, numpy.newaxis] <= deciding)).any(axis=0)
+        return verdicts, errors
+
+    def first_failure(self, assertion, ticks):
+        """Return the first tick of the range of ticks the assertion fails at, or None if it holds at all
+        of them."""
+        if not ticks:
+            return None
+        verdicts, errors = self.verdicts(assertion, ticks[0], ticks[-1] + 1)
+        failures = ~verdicts
+        failure = int(numpy.argmax(failures)) if failures.any() else None
+        # the interpreter stops at the first failure, so only errors up to it are raised
+        if errors[:len(errors) if failure is None else failure + 1].any():
+            raise tac_calculation.CalculationError('Division by zero')
+        return None if failure is None else ticks[0] + failure
+
+    def verdict(self, assertion, tick):
+        """Return the verdict of the assertion at the tick."""
+        verdicts, errors = self.verdicts(assertion, tick, tick + 1)
+        if errors[0]:
+            raise tac_calculation.CalculationError('Division by zero')
+        return bool(verdicts[0])
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+import unittest
+
+import tac_project
+
+#
+# Tests of the order of concurrent projects, run from the repository root:
+#   python -m unittest test_tac_project
+#
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_list_order(self):
+        # the third project shares a port with the first one, so it waits for it; the second one doesn't
+        scheduler = tac_project.Scheduler([{'A'}, {'B'}, {'A'}], [10, 10, 10], 3)
+        self.assertEqual(scheduler.start(), [0, 1])
+        scheduler.finish(0)
+        self.assertEqual(scheduler.start(), [2])
+
+    def test_ports_changed_by_conversion(self):
+        # the first project is being converted; its earlier AutomationConfig maps it to other ports than the second
+        # one, which starts meanwhile
+        scheduler = tac_project.Scheduler([{'A'}, {'B'}], [10, 10], 2, available=[1])
+        self.assertEqual(scheduler.start(), [1])
+        # the converted project turns out to use the port of the running one
+        scheduler.make_available(0, {'B'}, 10)
+        self.assertFalse(scheduler.ready(0))
+        self.assertEqual(scheduler.start(), [])
+        scheduler.finish(1)
+        self.assertEqual(scheduler.start(), [0])
+
+    def test_ports_changed_by_conversion_lpt(self):
+        scheduler = tac_project.Scheduler([{'A'}, {'B'}], [10, 20], 2, lpt=True, available=[1])
+        self.assertEqual(scheduler.start(), [1])
+        scheduler.make_available(0, {'B'}, 10)
+        self.assertEqual(scheduler.start(), [])
+        scheduler.finish(1)
+        self.assertEqual(scheduler.start(), [0])
+
+
+if __name__ == '__main__':
+    unittest.main()